@@ -0,0 +1,435 @@
+"""
+Stand-in for lldb's python module used to benchmark the plugin without a debugger
+
+Only the parts of the SB API used by plugin/defrustrator.py are implemented. Frames, blocks and
+types are synthetic (see `make_frame` and `make_template_type`), the inferior is simulated by
+`Inferior`, which answers the calls of the plugin to the bridge library and records every
+expression passed to `SBFrame.EvaluateExpression`.
+"""
+import re
+import ast
+import struct
+
+LLDB_INVALID_ADDRESS = 0xffffffffffffffff
+eBasicTypeInt = 5
+eStateStopped = 5
+eValueTypeRegister = 6
+
+class SBError:
+    def __init__(self, message=None):
+        self.message = message
+    def Success(self):
+        return self.message is None
+    def Fail(self):
+        return self.message is not None
+    def __str__(self):
+        return self.message or "success"
+
+class SBExpressionOptions:
+    def __init__(self):
+        self.timeout = 0
+    def SetTimeoutInMicroSeconds(self, timeout):
+        self.timeout = timeout
+    def SetUnwindOnError(self, unwind):
+        pass
+    def SetTryAllThreads(self, try_all_threads):
+        pass
+    def SetIgnoreBreakpoints(self, ignore):
+        pass
+
+class SBFileSpec:
+    def __init__(self, path):
+        self.path = path
+    def GetFilename(self):
+        return self.path.rsplit("/", 1)[-1]
+    def __str__(self):
+        return self.path
+
+class SBModule:
+    def __init__(self, path):
+        self.path = path
+    def IsValid(self):
+        return True
+    def GetFileSpec(self):
+        return SBFileSpec(self.path)
+    def GetUUIDString(self):
+        return "%08X" % (hash(self.path) & 0xffffffff)
+
+class SBTypeMember:
+    def __init__(self, name, type):
+        self.name = name
+        self.type = type
+    def GetName(self):
+        return self.name
+    def GetType(self):
+        return self.type
+
+class SBType:
+    def __init__(self, name, pointee=None, template_args=(), basic_type=None, module=None, fields=()):
+        self.name = name
+        self.pointee = pointee
+        self.template_args = list(template_args)
+        self.basic_type = basic_type
+        self.module = module
+        self.fields = [SBTypeMember(field_name, field_type) for (field_name, field_type) in fields]
+    def IsValid(self):
+        return True
+    def GetName(self):
+        return self.name
+    def GetModule(self):
+        return self.module if self.module is not None else SBModule("")
+    def GetCanonicalType(self):
+        return self
+    def GetUnqualifiedType(self):
+        return self
+    def IsFunctionType(self):
+        return False
+    def IsPointerType(self):
+        return self.pointee is not None
+    def IsReferenceType(self):
+        return False
+    def GetPointeeType(self):
+        return self.pointee
+    def GetDereferencedType(self):
+        return self
+    def GetNumberOfFields(self):
+        return len(self.fields)
+    def GetFieldAtIndex(self, i):
+        return self.fields[i]
+    def GetNumberOfMemberFunctions(self):
+        return 0
+    def GetNumberOfDirectBaseClasses(self):
+        return 0
+    def GetNumberOfTemplateArguments(self):
+        return len(self.template_args)
+    def GetTemplateArgumentType(self, i):
+        return self.template_args[i]
+    def GetBasicType(self, basic_type):
+        return int_type if basic_type == eBasicTypeInt else SBType("<basic type>")
+    def __eq__(self, other):
+        return isinstance(other, SBType) and other.name == self.name
+    def __hash__(self):
+        return hash(self.name)
+
+int_type = SBType("int", basic_type=eBasicTypeInt)
+
+class SBDeclaration:
+    def __init__(self, path, line):
+        self.path = path
+        self.line = line
+    def IsValid(self):
+        return self.path is not None
+    def GetFileSpec(self):
+        return SBFileSpec(self.path)
+    def GetLine(self):
+        return self.line
+    def GetColumn(self):
+        return 0
+
+class SBValue:
+    def __init__(self, name=None, type=None, address=LLDB_INVALID_ADDRESS, id=0, value=0, error=None, line=None):
+        self.name = name
+        self.type = type
+        self.address = address
+        self.id = id
+        self.value = value
+        self.error = SBError(error)
+        self.line = line
+    def IsValid(self):
+        return True
+    def GetName(self):
+        return self.name
+    def GetType(self):
+        return self.type
+    def GetID(self):
+        return self.id
+    def GetError(self):
+        return self.error
+    def GetDeclaration(self):
+        return SBDeclaration("/fake/program.cpp" if self.line is not None else None, self.line or 0)
+    def GetLoadAddress(self):
+        return self.address
+    def GetLocation(self):
+        return "0x%x" % self.address if self.address != LLDB_INVALID_ADDRESS else "rax"
+    def AddressOf(self):
+        return SBValue(value=self.address)
+    def Dereference(self):
+        return self
+    def GetValueAsUnsigned(self):
+        return self.value
+    def GetValueAsSigned(self):
+        return self.value
+    def GetValue(self):
+        return str(self.value)
+
+class SBAddress:
+    def __init__(self, address):
+        self.address = address
+    def GetFileAddress(self):
+        return self.address
+    def GetLoadAddress(self, target=None):
+        return self.address
+
+class SBBlock:
+    def __init__(self, variables, parent, address_range):
+        self.variables = variables
+        self.parent = parent
+        self.address_range = address_range
+    def IsValid(self):
+        return self.variables is not None
+    def GetParent(self):
+        return self.parent if self.parent is not None else SBBlock(None, None, None)
+    def GetVariables(self, frame, arguments, locals, statics, use_dynamic):
+        return list(self.variables)
+    def GetNumRanges(self):
+        return 1
+    def GetRangeStartAddress(self, i):
+        return SBAddress(self.address_range[0])
+    def GetRangeEndAddress(self, i):
+        return SBAddress(self.address_range[1])
+
+class SBFunction:
+    def GetStartAddress(self):
+        return SBAddress(0x401000)
+
+class SBSymbol:
+    def __init__(self, address):
+        self.address = address
+    def GetStartAddress(self):
+        return SBAddress(self.address)
+
+class SBSymbolContext:
+    def __init__(self, address):
+        self.address = address
+    def GetSymbol(self):
+        return SBSymbol(self.address)
+
+class Inferior:
+    """
+    Simulated debugged process with the bridge library loaded
+    """
+    bridge_base = 0x7f0000000000
+    result_address = 0x7f1000000000
+    bitmap_address = 0x7f1800000000
+
+    def __init__(self):
+        self.memory = {}
+        self.next_allocation = 0x7f2000000000
+        self.entry_points = []
+        self.command_buffer = (0, 0)
+        # names declared in the interpreter
+        self.names = []
+        # all expressions evaluated and all commands sent to the interpreter
+        self.expressions = []
+        self.commands = []
+
+    def entry_point(self, name):
+        if name not in self.entry_points:
+            self.entry_points.append(name)
+        return self.bridge_base + 0x100*self.entry_points.index(name)
+
+    def allocate(self, size):
+        address = self.next_allocation
+        self.next_allocation += (size + 0xfff) & ~0xfff
+        return address
+
+    def write(self, address, data):
+        self.memory[address] = bytes(data)
+
+    def read(self, address, size):
+        for (start, data) in self.memory.items():
+            if start <= address and address+size <= start+len(data):
+                return data[address-start:address-start+size]
+        return bytes(size)
+
+    def evaluate(self, code):
+        self.expressions.append(code)
+        if "dlopen" in code:
+            return SBValue(value=0x1000)
+        match = re.search(r"\(\(.*?\) (0x[0-9a-f]+)\)\((.*)\);?\s*$", code, re.S)
+        if match is None:
+            return SBValue(error="unsupported expression")
+        name = self.entry_points[(int(match.group(1), 16) - self.bridge_base)//0x100]
+        return SBValue(value=getattr(self, name[len("defrustrator_"):])(match.group(2), code))
+
+    # bridge library
+    def types_exist(self, args, code):
+        names = ast.literal_eval("[" + re.search(r"\{(.*)\};", code, re.S).group(1) + "]")
+        bitmap = bytearray((len(names)+7)//8)
+        for (i, name) in enumerate(names):
+            if not name.startswith("Unknown"):
+                bitmap[i//8] |= 1 << (i % 8)
+        self.write(self.bitmap_address, bitmap)
+        return self.bitmap_address
+
+    def reserve_command_buffer(self, args, code):
+        size = int(args)
+        if self.command_buffer[1] < size:
+            self.command_buffer = (self.allocate(size), size)
+        return self.command_buffer[0]
+
+    def send_command(self, args, code):
+        (address, size) = [arg.strip() for arg in args.split(",")]
+        command = self.read(int(address.split(")")[-1], 16), int(size)).decode("utf-8")
+        self.commands.append(command)
+        result = struct.pack("=iIIIQQ", 0, 0, 0, 0, 0, 0)
+        self.write(self.result_address, result)
+        return len(result)
+
+    def call_compiled(self, args, code):
+        result = struct.pack("=iIIIQQ", 0, 0, 0, 0, 0, 0)
+        self.write(self.result_address, result)
+        return len(result)
+
+    def declared_names(self, args, code):
+        output = "\n".join(self.names).encode("utf-8")
+        result = struct.pack("=iIIIQQ", 0, 0, len(output), 0, 0, 0) + output
+        self.write(self.result_address, result)
+        return len(result)
+
+    def result_buffer(self, args, code):
+        return self.result_address
+
+    def __getattr__(self, name):
+        # entry points without a result worth simulating
+        return lambda args, code: 0
+
+inferior = Inferior()
+
+class SBFrame:
+    def __init__(self, variables, block):
+        self.variables = variables
+        self.block = block
+    def IsValid(self):
+        return True
+    def GetVariables(self, arguments, locals, statics, in_scope_only):
+        return list(self.variables)
+    def GetBlock(self):
+        return self.block
+    def GetModule(self):
+        return main_module
+    def GetFunction(self):
+        return SBFunction()
+    def GetCFA(self):
+        return 0x7ffe00000000
+    def GetPC(self):
+        return 0x401010
+    def GetThread(self):
+        return thread
+    def EvaluateExpression(self, code, options=None):
+        return inferior.evaluate(code)
+
+class SBThread:
+    def GetSelectedFrame(self):
+        return frame
+    def GetProcess(self):
+        return process
+
+class SBProcess:
+    def __init__(self):
+        self.stop_id = 1
+    def __bool__(self):
+        return True
+    def GetUniqueID(self):
+        return 1
+    def GetAddressByteSize(self):
+        return 8
+    def GetStopID(self):
+        return self.stop_id
+    def GetState(self):
+        return eStateStopped
+    def GetSelectedThread(self):
+        return thread
+    def GetTarget(self):
+        return target
+    def ReadMemory(self, address, size, error):
+        return inferior.read(address, size)
+    def WriteMemory(self, address, data, error):
+        inferior.write(address, data)
+        return len(data)
+    def SendAsyncInterrupt(self):
+        pass
+
+class SBTarget:
+    def GetProcess(self):
+        return process
+    def FindFunctions(self, name):
+        return [SBSymbolContext(inferior.entry_point(name))]
+    def FindSymbols(self, name):
+        return [SBSymbolContext(0)]
+    def module_iter(self):
+        return iter([main_module])
+
+class SBCommandInterpreter:
+    def WasInterrupted(self):
+        return False
+
+class SBDebugger:
+    def GetSelectedTarget(self):
+        return target
+    def GetCommandInterpreter(self):
+        return SBCommandInterpreter()
+    def HandleCommand(self, command):
+        pass
+
+main_module = SBModule("/fake/program")
+process = SBProcess()
+thread = SBThread()
+target = SBTarget()
+debugger = SBDebugger()
+frame = None
+
+#
+# Builders for synthetic frames and types
+#
+def make_template_type(depth, width, name_length):
+    """
+    Create a nested template type with `depth` levels, `width` arguments per level and template names
+    of `name_length` characters, e.g. `Tmpl<Tmpl<int, 4294967295>, 4294967295>`
+    """
+    template = "Ns::" + "T"*max(name_length-4, 1)
+    if depth == 0:
+        return int_type
+    inner = make_template_type(depth-1, width, name_length)
+    args = [inner] + [int_type]*(width-1)
+    name = template + "<" + ", ".join([inner.GetName()] + ["4294967295"]*(width-1)) + ">"
+    return SBType(name, template_args=args, module=main_module)
+
+def make_struct_type(num_fields, field_type=int_type):
+    """
+    Create a struct with `num_fields` fields `f0`, `f1`, ... of type `field_type`
+    """
+    return SBType("Ns::S{}".format(num_fields), module=main_module,
+                  fields=[("f{}".format(i), field_type) for i in range(num_fields)])
+
+# like lldb every value object gets a new id, i.e. the ids differ between frames of the same function
+value_ids = [0]
+frame_spec = None
+
+def new_value_id():
+    value_ids[0] += 1
+    return value_ids[0]
+
+def make_frame(num_vars, depth, var_type=int_type):
+    """
+    Create a frame with `num_vars` variables of type `var_type` spread over `depth` nested blocks
+    and make it the selected frame
+    """
+    global frame, frame_spec
+    frame_spec = (num_vars, depth, var_type)
+    variables = [SBValue("v{}".format(i), var_type, 0x7ffe00001000 + 64*i, new_value_id(), i+1, line=10+i)
+                 for i in range(num_vars)]
+    block = None
+    for level in range(depth, 0, -1):
+        block = SBBlock([var for (i, var) in enumerate(variables) if i % depth == level-1], block,
+                        (0x401000 + 0x10*level, 0x402000 - 0x10*level))
+    frame = SBFrame(variables, block)
+    # a new frame means a new stop
+    process.stop_id += 1
+    return frame
+
+def new_stop():
+    """
+    Stop again in the same function, lldb creates a new frame with new value objects
+    """
+    return make_frame(*frame_spec)
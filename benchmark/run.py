@@ -0,0 +1,232 @@
+#!/usr/bin/python
+"""
+Benchmarks of the hot paths of the plugin
+
+By default the plugin is run against the lldb stand-in in benchmark/fake, measuring scope analysis,
+get_type_str and the evaluation of commands (time, number of lldb expressions and size of the code
+sent to the interpreter) as the number of variables, the nesting depth and the length of type names
+grow. With --lldb the example programs are debugged with the real lldb instead, which requires
+lldb's python module, cling and a build of the plugin and the examples (in build/).
+"""
+import argparse
+import contextlib
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+benchmark_path = os.path.dirname(os.path.abspath(__file__))
+base_path = os.path.dirname(benchmark_path)
+
+def import_plugin():
+    # keep caches written by the plugin out of the users cache directory
+    os.environ["XDG_CACHE_HOME"] = tempfile.mkdtemp(prefix="defrustrator-benchmark-")
+    sys.path.insert(0, os.path.join(base_path, "plugin"))
+    import defrustrator
+    return defrustrator
+
+def measure(function, repeat, setup=None):
+    """
+    Run `function` `repeat` times and return the best wall time in milliseconds
+    """
+    best = None
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        duration = (time.perf_counter() - start)*1000
+        best = duration if best is None else min(best, duration)
+    return best
+
+def print_table(title, header, rows):
+    print("\n" + title)
+    widths = [max(len(str(row[i])) for row in [header] + rows) for i in range(len(header))]
+    for row in [header] + rows:
+        print("  ".join(str(cell).rjust(width) for (cell, width) in zip(row, widths)))
+
+#
+# Benchmarks against the lldb stand-in
+#
+def reset_caches(plugin):
+    """
+    Forget everything the plugin cached, as if a new debug session was started
+    """
+    plugin.scope_cache.clear()
+    plugin.type_str_cache.clear()
+    plugin.type_cache.clear()
+    plugin.frame_variables_cache["key"] = None
+    plugin.stop_bindings["key"] = None
+    plugin.compiled_expressions.clear()
+
+def new_stop(lldb):
+    lldb.new_stop()
+
+def benchmark_scope_analysis(plugin, lldb, repeat):
+    rows = []
+    for num_vars in [10, 50, 200, 1000]:
+        for depth in [1, 4, 16]:
+            frame = lldb.make_frame(num_vars, depth)
+            cold = measure(lambda: plugin.get_scope(frame), repeat, lambda: reset_caches(plugin))
+            # variables at a new stop in a scope that has been analyzed before
+            plugin.get_scope(frame)
+            warm = measure(lambda: plugin.get_frame_variables(lldb.frame), repeat, lambda: new_stop(lldb))
+            same_stop = measure(lambda: plugin.get_frame_variables(lldb.frame), repeat)
+            # the scope analyzed before is reused at every new stop and has to match its new value objects
+            assert plugin.get_scope(lldb.frame) is plugin.get_scope(frame)
+            assert len(plugin.get_frame_variables(lldb.frame)) == num_vars
+            rows.append([num_vars, depth, "%.3f" % cold, "%.3f" % warm, "%.4f" % same_stop])
+    print_table("Scope analysis (ms)", ["variables", "depth", "cold", "new stop", "same stop"], rows)
+
+def benchmark_type_str(plugin, lldb, repeat):
+    rows = []
+    for depth in [1, 4, 8]:
+        for name_length in [8, 64, 512]:
+            sbtype = lldb.make_template_type(depth, 3, name_length)
+            cold = measure(lambda: plugin.get_type_str(sbtype), repeat, lambda: plugin.type_str_cache.clear())
+            cached = measure(lambda: plugin.get_type_str(sbtype), repeat)
+            rows.append([depth, name_length, len(sbtype.GetName()), "%.3f" % cold, "%.4f" % cached])
+    print_table("get_type_str (ms)", ["depth", "name length", "type length", "cold", "cached"], rows)
+
+def benchmark_eval_expr(plugin, lldb, repeat):
+    rows = []
+    inferior = lldb.inferior
+    for num_vars in [10, 50, 200]:
+        for (label, code, options) in [("p v0", "v0", {}), ("p v0 --all-variables", "v0", {"all-variables": True})]:
+            var_type = lldb.make_template_type(3, 3, 32)
+            lldb.make_frame(num_vars, 4, var_type)
+            debugger = lldb.debugger
+
+            def evaluate():
+                with contextlib.redirect_stdout(io.StringIO()):
+                    plugin.print_expr(debugger, code, options)
+
+            def counted(setup):
+                setup()
+                (expressions, commands) = (len(inferior.expressions), len(inferior.commands))
+                evaluate()
+                sent = sum(len(command) for command in inferior.commands[commands:])
+                return len(inferior.expressions) - expressions, sent
+
+            cold_setup = lambda: (reset_caches(plugin), new_stop(lldb))
+            (cold_expressions, cold_sent) = counted(cold_setup)
+            cold = measure(evaluate, repeat, cold_setup)
+            (stop_expressions, stop_sent) = counted(lambda: new_stop(lldb))
+            stop = measure(evaluate, repeat, lambda: new_stop(lldb))
+            (warm_expressions, warm_sent) = counted(lambda: None)
+            warm = measure(evaluate, repeat)
+            rows.append([num_vars, label,
+                         "%.2f" % cold, cold_expressions, cold_sent,
+                         "%.2f" % stop, stop_expressions, stop_sent,
+                         "%.2f" % warm, warm_expressions, warm_sent])
+    print_table("Command evaluation (ms, lldb expressions, bytes sent to the interpreter)",
+                ["variables", "command",
+                 "cold", "expr", "bytes",
+                 "new stop", "expr", "bytes",
+                 "same stop", "expr", "bytes"], rows)
+
+def benchmark_completion(plugin, lldb, repeat):
+    from prompt_toolkit.document import Document
+    rows = []
+    for num_names in [10000, 100000, 1000000]:
+        lldb.inferior.names = ["Ns{}::name{}".format(i % 100, i) for i in range(num_names)]
+        var_type = lldb.make_struct_type(50, lldb.make_struct_type(50))
+        frame = lldb.make_frame(200, 4, var_type)
+        debugger = lldb.debugger
+        with contextlib.redirect_stdout(io.StringIO()):
+            # names queried from the interpreter and from the disk cache
+            if os.path.isfile(plugin.cling_names_path()):
+                os.remove(plugin.cling_names_path())
+            query = measure(lambda: plugin.get_cling_names(debugger), 1)
+            cached = measure(lambda: plugin.ReplCompleter(plugin.get_frame_variables(frame),
+                                                          plugin.get_cling_names(debugger)), repeat)
+            completer = plugin.ReplCompleter(plugin.get_frame_variables(frame), plugin.get_cling_names(debugger))
+
+        def complete(text):
+            return list(completer.get_completions(Document(text), None))
+
+        identifier = measure(lambda: complete("Ns4::name4"), repeat)
+        plugin.member_indexes.clear()
+        member_cold = measure(lambda: complete("v1.f2.f"), 1)
+        member = measure(lambda: complete("v1.f2.f"), repeat)
+        rows.append([num_names, "%.1f" % query, "%.1f" % cached, "%.3f" % identifier, "%.3f" % member_cold, "%.3f" % member])
+    print_table("Repl completion (ms)", ["names", "query", "cached", "identifier", "member (cold)", "member"], rows)
+
+def run_fake_benchmarks(repeat):
+    sys.path.insert(0, os.path.join(benchmark_path, "fake"))
+    import lldb
+    plugin = import_plugin()
+    # nothing to precompile in the stand-in
+    plugin.use_precompiled_headers = False
+    # load the bridge once such that the loader does not end up in the measurements
+    lldb.make_frame(1, 1)
+    with contextlib.redirect_stdout(io.StringIO()):
+        plugin.eval_expr(lldb.debugger, "", {"global": True})
+
+    benchmark_scope_analysis(plugin, lldb, repeat)
+    benchmark_type_str(plugin, lldb, repeat)
+    benchmark_eval_expr(plugin, lldb, repeat)
+    benchmark_completion(plugin, lldb, repeat)
+
+#
+# Benchmarks with the real lldb
+#
+lldb_examples = [
+    # (executable, source file, line, commands)
+    ("example_scope", "scope.cpp", 7, ["cling p a", "cling p c", "cling p a + c"]),
+    ("example_eigen2", "eigen2.cpp", 26, ["cling p A", "cling p x", "cling p (A*x).sum()"]),
+]
+
+def run_lldb_benchmarks(repeat):
+    try:
+        lldb_python_path = subprocess.check_output(["lldb", "-P"], universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        print("lldb not found, skipping")
+        return
+    sys.path.insert(0, lldb_python_path)
+    import lldb
+    import_plugin()
+
+    rows = []
+    for (executable, source, line, commands) in lldb_examples:
+        executable_path = os.path.join(base_path, "build", executable)
+        if not os.path.isfile(executable_path):
+            print("{} not found (build the examples first), skipping".format(executable_path))
+            continue
+        debugger = lldb.SBDebugger.Create()
+        debugger.SetAsync(False)
+        debugger.HandleCommand("command script import " + os.path.join(base_path, "plugin", "defrustrator.py"))
+        target = debugger.CreateTarget(executable_path)
+        target.BreakpointCreateByLocation(source, line)
+        process = target.LaunchSimple(None, None, os.getcwd())
+        if not process or process.GetState() != lldb.eStateStopped:
+            print("{} could not be stopped at {}:{}, skipping".format(executable, source, line))
+            continue
+
+        for (i, command) in enumerate(commands):
+            result = lldb.SBCommandReturnObject()
+            timings = []
+            for _ in range(repeat if i > 0 else 1):
+                start = time.perf_counter()
+                debugger.GetCommandInterpreter().HandleCommand(command, result)
+                timings.append((time.perf_counter() - start)*1000)
+            # the first command also loads the bridge library and creates the interpreter
+            rows.append([executable, command, "%.1f" % timings[0], "%.1f" % min(timings)])
+        process.Kill()
+        lldb.SBDebugger.Destroy(debugger)
+    print_table("Commands with lldb (ms)", ["example", "command", "first", "best"], rows)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lldb", action="store_true", help="debug the example programs with the real lldb")
+    parser.add_argument("--repeat", type=int, default=5, help="number of repetitions per measurement")
+    args = parser.parse_args()
+    if args.lldb:
+        run_lldb_benchmarks(args.repeat)
+    else:
+        run_fake_benchmarks(args.repeat)
+
+if __name__ == "__main__":
+    main()
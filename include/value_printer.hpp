@@ -1,17 +1,36 @@
 #include <type_traits>
 #include <typeinfo>
+#include <ostream>
 #include <cxxabi.h>
 #include <memory>
 #include <string>
 #include <cstdlib>
+#include <cstddef>
+#include <complex>
+#include <vector>
+#include <array>
 
 #ifndef DEFRUSTRATOR_VALUE_PRINTER_HPP
 #define DEFRUSTRATOR_VALUE_PRINTER_HPP
 
 namespace Defrustrator {
 
+// stream the output of commands is written to (defined in the bridge library)
+std::ostream& output();
+
+// record that a command finished compiling and started executing (defined in the bridge library)
+void mark_execution();
+
+// make a function compiled by the plugin callable by its id (defined in the bridge library)
+void register_compiled(int id, void (*function)(void**));
+
 namespace Utils {
 
+template <typename...>
+struct Void {
+    typedef void type;
+};
+
 template <typename T, typename = void>
 struct InsertionOperatorExists {
     static constexpr bool value = false;
@@ -45,17 +64,162 @@ template <class T> std::string type_name() {
 template <typename T, typename = void>
 struct ValuePrinter {
     static void print(const T& val) {
-        std::cout << "(" << Utils::type_name<T>() << ") @" << &val << std::endl;
+        output() << "(" << Utils::type_name<T>() << ") @" << &val << std::endl;
     }
 };
 
 template <typename T>
 struct ValuePrinter<T, typename std::enable_if<Utils::InsertionOperatorExists<T>::value>::type> {
     static void print(const T& val) {
-        std::cout << val << std::endl;
+        output() << val << std::endl;
+    }
+};
+
+// Bulk dumps
+//  containers with a DataView expose their elements as contiguous memory that the plugin copies
+//  directly into a file, described by a line `defrustrator-data <address> <dtype> <fortran order> <shape...>`
+
+// element type in numpy's notation, e.g. `<f8` for double
+template <typename T, typename = void>
+struct DType {
+    static constexpr bool available = false;
+};
+
+template <typename T>
+struct DType<T, typename std::enable_if<std::is_arithmetic<T>::value>::type> {
+    static constexpr bool available = true;
+    static std::string str() {
+        char kind = std::is_same<T, bool>::value ? 'b'
+                    : std::is_floating_point<T>::value ? 'f'
+                    : std::is_signed<T>::value ? 'i' : 'u';
+        return std::string(sizeof(T) == 1 ? "|" : "<") + kind + std::to_string(sizeof(T));
+    }
+};
+
+template <typename T>
+struct DType<std::complex<T>, typename std::enable_if<std::is_floating_point<T>::value>::type> {
+    static constexpr bool available = true;
+    static std::string str() {
+        return "<c" + std::to_string(sizeof(std::complex<T>));
+    }
+};
+
+template <typename T, typename = void>
+struct DataView {
+    static constexpr bool available = false;
+};
+
+template <typename T, typename A>
+struct DataView<std::vector<T, A>, typename std::enable_if<DType<T>::available
+                                                           && !std::is_same<T, bool>::value>::type> {
+    static constexpr bool available = true;
+    typedef T Scalar;
+    typedef std::vector<T, A> Plain;
+    static const void* data(const std::vector<T, A>& val) { return val.data(); }
+    static std::vector<std::size_t> shape(const std::vector<T, A>& val) { return {val.size()}; }
+    static bool fortran_order() { return false; }
+    static bool contiguous(const std::vector<T, A>&) { return true; }
+};
+
+template <typename T, std::size_t N>
+struct DataView<std::array<T, N>, typename std::enable_if<DType<T>::available>::type> {
+    static constexpr bool available = true;
+    typedef T Scalar;
+    typedef std::array<T, N> Plain;
+    static const void* data(const std::array<T, N>& val) { return val.data(); }
+    static std::vector<std::size_t> shape(const std::array<T, N>&) { return {N}; }
+    static bool fortran_order() { return false; }
+    static bool contiguous(const std::array<T, N>&) { return true; }
+};
+
+// dense Eigen objects (matrices, arrays, maps and blocks)
+//  detected by their members such that Eigen does not need to be included
+template <typename T>
+struct DataView<T, typename std::enable_if<DType<typename T::Scalar>::available, typename Utils::Void<
+        decltype(std::declval<const T&>().data()),
+        decltype(std::declval<const T&>().innerStride()),
+        decltype(std::declval<const T&>().outerStride()),
+        typename T::PlainObject,
+        std::integral_constant<bool, T::IsRowMajor>,
+        std::integral_constant<bool, T::IsVectorAtCompileTime>>::type>::type> {
+    static constexpr bool available = true;
+    typedef typename T::Scalar Scalar;
+    typedef typename T::PlainObject Plain;
+    static const void* data(const T& val) { return val.data(); }
+    static std::vector<std::size_t> shape(const T& val) {
+        if (T::IsVectorAtCompileTime)
+            return {static_cast<std::size_t>(val.size())};
+        return {static_cast<std::size_t>(val.rows()), static_cast<std::size_t>(val.cols())};
+    }
+    static bool fortran_order() { return !T::IsRowMajor; }
+    static bool contiguous(const T& val) {
+        return val.innerStride() == 1
+               && (T::IsVectorAtCompileTime || val.outerStride() == (T::IsRowMajor ? val.cols() : val.rows()));
+    }
+};
+
+namespace Utils {
+
+// value of the last dump, kept alive until the next one such that the plugin can read temporaries
+inline std::shared_ptr<void>& dump_holder() {
+    static std::shared_ptr<void> holder;
+    return holder;
+}
+
+template <typename T>
+const typename std::decay<T>::type& hold(T&& val) {
+    auto held = std::make_shared<typename std::decay<T>::type>(std::forward<T>(val));
+    dump_holder() = held;
+    return *held;
+}
+
+template <typename T>
+void describe_data(const T& val) {
+    output() << "defrustrator-data " << DataView<T>::data(val) << " "
+             << DType<typename DataView<T>::Scalar>::str() << " " << DataView<T>::fortran_order();
+    for (std::size_t extent : DataView<T>::shape(val))
+        output() << " " << extent;
+    output() << std::endl;
+}
+
+}
+
+template <typename T, typename = void>
+struct DataDumper {
+    template <typename U>
+    static void dump(U&&) {
+        output() << "error: no contiguous data view for " << Utils::type_name<T>() << std::endl;
+    }
+};
+
+template <typename T>
+struct DataDumper<T, typename std::enable_if<DataView<T>::available>::type> {
+    template <typename U>
+    static void dump(U&& val) {
+        if (!DataView<T>::contiguous(val))
+            Utils::describe_data(Utils::hold(typename DataView<T>::Plain(val)));
+        else if (std::is_lvalue_reference<U>::value)
+            Utils::describe_data(val);
+        else
+            Utils::describe_data(Utils::hold(std::forward<U>(val)));
     }
 };
 
+// expressions (e.g. Eigen products) are evaluated into their plain type first
+template <typename T>
+struct DataDumper<T, typename std::enable_if<!DataView<T>::available
+                                             && DataView<typename T::PlainObject>::available>::type> {
+    template <typename U>
+    static void dump(U&& val) {
+        Utils::describe_data(Utils::hold(typename T::PlainObject(val)));
+    }
+};
+
+template <typename T>
+void dump(T&& val) {
+    DataDumper<typename std::decay<T>::type>::dump(std::forward<T>(val));
+}
+
 };
 
 #endif
@@ -6,10 +6,19 @@ import time
 import re
 import ctypes
 import json
+import struct
+import collections
+import hashlib
+import subprocess
+import contextlib
+import bisect
+import math
 from prompt_toolkit import prompt
+from prompt_toolkit.completion import Completer, Completion
 from prompt_toolkit.history import FileHistory
 from prompt_toolkit.lexers import PygmentsLexer
 from pygments.lexers.c_cpp import CppLexer
+from pygments.token import Token
 from os.path import expanduser
 
 # todo: add command to add include paths to cling
@@ -36,16 +45,105 @@ cling_path = os.path.dirname(__file__) + "/../bin/cling"
 base_path = os.path.dirname(__file__) + "/../"
 
 history_file = expanduser("~/.lldb-defrustrator-history")
+cache_path = os.path.join(os.environ.get("XDG_CACHE_HOME", expanduser("~/.cache")), "defrustrator")
+
+# precompiled headers for the configs are built with the clang shipped with cling
+use_precompiled_headers = True
+pch_compiler = base_path + "/bin/cling/bin/clang++"
 current_process_id = None
 loaded_configs = []
 
+# types known (or not known) to the interpreter keyed by the unique id of the process
 type_cache = {}
 
+# warm-up of the interpreter at the first stop of a process (opt-in)
+warmup_enabled = os.environ.get("DEFRUSTRATOR_WARMUP", "0") == "1"
+# state of the warm-up ("warming up", "ready" or "failed") and an event set when it has finished,
+#  both keyed by the unique id of the process
+warmup_states = {}
+warmup_done = {}
+# held while commands are evaluated, such that the warm-up (running on the event listener thread)
+#  and commands never load the bridge or the configs at the same time
+interpreter_lock = threading.RLock()
+
+# thread listening for process and target events
+event_listener = None
+
+# index of the configs found next to modules keyed by the uuid of the module
+config_index = None
+config_index_path = os.path.join(cache_path, "config_index.json")
+# modules loaded since the configs were last applied
+pending_modules = []
+pending_modules_lock = threading.Lock()
+# uuids of the modules whose config has been applied keyed by the unique id of the process
+applied_module_configs = {}
+
+# statistics of the most recent commands, the command currently running and aggregated over all commands
+stats_history = collections.deque(maxlen=10)
+stats_current = None
+stats_aggregate = {"commands": 0, "total": 0.0, "phases": collections.Counter(), "counters": collections.Counter()}
+
+# ids of the functions compiled from expressions (see get_compiled_function) per process, code and bindings
+compiled_expressions = {}
+compiled_counter = 0
+
+# conditions (c++ code) of breakpoints by breakpoint id
+breakpoint_conditions = {}
+
+# watched expressions evaluated at every stop and the targets (by executable) the stop hook was added to
+watch_expressions = []
+watch_stop_hooks = set()
+
+# configs loaded into the interpreter of the current process (key of the cached names known to cling)
+interpreter_configs = []
+
+# names of the members of types (by type name) per module build-id, cached on disk in `completion_path`
+completion_path = os.path.join(cache_path, "completion")
+member_indexes = {}
+dirty_member_indexes = set()
+
+# size of the chunks in which dumped data is read from the process
+dump_chunk_size = 1 << 24
+
+# interval (in seconds) in which a running evaluation checks if it was interrupted with ctrl+c
+interrupt_check_interval = 0.1
+
 # read bridge code
 with open(base_path + '/src/plugin_bridge.cpp', 'r') as file:
     bridge_code = file.read()
 bridge_code=bridge_code.replace("DEFRUSTRATOR_BASE_PATH", base_path)
 
+# entry points of the bridge library and the function pointer types used to call them
+bridge_functions = {
+    "defrustrator_send_command": "unsigned long(*)(const char*, unsigned long)",
+    "defrustrator_call_compiled": "unsigned long(*)(int, void**)",
+    "defrustrator_declared_names": "unsigned long(*)()",
+    "defrustrator_result_buffer": "const char*(*)()",
+    "defrustrator_reserve_command_buffer": "char*(*)(unsigned long)",
+    "defrustrator_types_exist": "const unsigned char*(*)(const char**, int)",
+    "defrustrator_add_include_path": "void(*)(const char*)",
+    "defrustrator_init_pch": "int(*)(const char*)",
+    "defrustrator_init": "void(*)()",
+}
+
+# load addresses of the bridge entry points keyed by the unique id of the process
+bridge_entry_points = {}
+
+# address and capacity of the command buffer in the inferior keyed by the unique id of the process
+command_buffers = {}
+
+# address of the result buffer in the inferior keyed by the unique id of the process
+result_buffers = {}
+
+# layout of the header of the result buffer (status, diagnostics size, output size, dropped output,
+#  compilation time and execution time in nanoseconds)
+result_header = struct.Struct("=iIIIQQ")
+
+# result of a command evaluated by the interpreter
+#  status is the compilation result (0: success, 1: failure, 2: more input expected), times are in seconds
+CommandResult = collections.namedtuple("CommandResult", ["status", "diagnostics", "output", "output_dropped",
+                                                         "compile_time", "execution_time"])
+
 class EvaluationThread(threading.Thread):
     def __init__(self, frame, code, options):
         threading.Thread.__init__(self)
@@ -53,13 +151,22 @@ class EvaluationThread(threading.Thread):
         self.code = code
         self.options = options
         self.result = None
+        # set as soon as the evaluation has finished
+        self.done = threading.Event()
     def run(self):
-        self.result = self.frame.EvaluateExpression(self.code, self.options)
+        try:
+            self.result = self.frame.EvaluateExpression(self.code, self.options)
+        finally:
+            self.done.set()
 
 class NoFrameException(RuntimeError):
     def __init__(self):
         super(RuntimeError, self).__init__("No frame here")
 
+class BridgeException(RuntimeError):
+    def __init__(self, message):
+        super(RuntimeError, self).__init__(message)
+
 import signal
 import sys
 from ctypes import *
@@ -120,80 +227,640 @@ class InterruptGuard:
 def __lldb_init_module (debugger, dict):
     debugger.HandleCommand('command script add -f defrustrator.cling cling')
     print("The \"cling\" command has been added successfully")
+    start_event_listener(debugger)
 
 def help():
     return '''The following subcommands are supported:
         include ("<file>"/<<file>>) -- Include source file
         repl -- Start cling repl
         print <expr> -- Print expressions return value using operator<< if possible
+        dump [--npy|--raw] <expr> <file> -- Write the elements of a container to a .npy or raw file
+        break-condition <breakpoint id> [<expr>] -- Only stop at the breakpoint if the expression is true
+        watch (add <expr>|remove <index>|list|show) -- Print expressions at every stop
+        source <file> -- Evaluate the statements in a file with a single command
         expression <expr> -- Evaluate expression
         include_directories <dir1>, <dir2>, ... -- Add include directories
         load_config <file> -- Load configuration of include directories, compile definitions, headers
         load_library <file> -- Load shared library
+        warmup (on|off) -- Prepare the interpreter in the background when the process stops
+        status -- Show whether the interpreter is ready
+        stats [--json] [--reset] -- Show timings and counters of recent commands
     '''
 
-def lldb_evaluate(debugger, code, interruptable=True):
-    global bridge_code, current_process_id
-    # prepend bridge code
-    code = bridge_code + "\n//\n// DYNAMIC CODE\n//\n" + str(code)
+class EventListener(threading.Thread):
+    """
+    Listen for modules being loaded and process stops
+
+    Loaded modules are queued such that their configs are applied before the next command. At the first
+    stop of each process the interpreter is warmed up if enabled.
+    """
+    def __init__(self, debugger):
+        threading.Thread.__init__(self, daemon=True)
+        self.debugger = debugger
+        self.listener = lldb.SBListener("defrustrator")
+        self.listener.StartListeningForEventClass(debugger, lldb.SBProcess.GetBroadcasterClassName(),
+                                                  lldb.SBProcess.eBroadcastBitStateChanged)
+        self.listener.StartListeningForEventClass(debugger, lldb.SBTarget.GetBroadcasterClassName(),
+                                                  lldb.SBTarget.eBroadcastBitModulesLoaded)
+
+    def run(self):
+        event = lldb.SBEvent()
+        while True:
+            if not self.listener.WaitForEvent(1, event):
+                continue
+            # the listener must survive any failure, otherwise loaded modules are not tracked anymore
+            try:
+                self.handle_event(event)
+            except Exception as e:
+                print("Defrustrator: handling event failed ({}: {})".format(type(e).__name__, e))
+
+    def handle_event(self, event):
+        if lldb.SBTarget.EventIsTargetEvent(event):
+            if event.GetType() & lldb.SBTarget.eBroadcastBitModulesLoaded:
+                with pending_modules_lock:
+                    for i in range(lldb.SBTarget.GetNumModulesFromEvent(event)):
+                        pending_modules.append(lldb.SBTarget.GetModuleAtIndexFromEvent(i, event))
+            return
+        if not warmup_enabled or not lldb.SBProcess.EventIsProcessEvent(event):
+            return
+        if lldb.SBProcess.GetStateFromEvent(event) != lldb.eStateStopped \
+                or lldb.SBProcess.GetRestartedFromEvent(event):
+            return
+        process = lldb.SBProcess.GetProcessFromEvent(event)
+        if process.GetUniqueID() not in warmup_states:
+            warm_up(self.debugger, process)
+
+def start_event_listener(debugger):
+    global event_listener
+    if event_listener is None:
+        event_listener = EventListener(debugger)
+        event_listener.start()
+
+def warm_up(debugger, process):
+    """
+    Load the bridge library, create the interpreter and load all configs for `process`
+    """
+    target = debugger.GetSelectedTarget()
+    if process.GetUniqueID() != target.GetProcess().GetUniqueID():
+        return
+    # libdl might not be loaded yet, try again at the next stop
+    if len(target.FindSymbols("dlopen")) == 0:
+        return
+
+    warmup_states[process.GetUniqueID()] = "warming up"
+    done = warmup_done[process.GetUniqueID()] = threading.Event()
+    start = time.time()
+    try:
+        with interpreter_lock:
+            # a command might have initialized the interpreter while the event was queued
+            if process.GetUniqueID() == current_process_id and process.GetUniqueID() in bridge_entry_points:
+                warmup_states[process.GetUniqueID()] = "ready"
+                return
+            print("Defrustrator: loading bridge library")
+            load_bridge(debugger)
+            print("Defrustrator: creating interpreter and loading configs")
+            prepare_interpreter(debugger)
+            bridge_call(debugger, "defrustrator_init", interruptable=False)
+        warmup_states[process.GetUniqueID()] = "ready"
+        print("Defrustrator: interpreter ready ({:.1f}s)".format(time.time()-start))
+    except Exception as e:
+        # any failure has to end the warm-up, otherwise commands wait for it forever
+        warmup_states[process.GetUniqueID()] = "failed"
+        print("Defrustrator: warm-up failed ({})".format(e))
+    finally:
+        done.set()
+
+def wait_for_warmup(debugger):
+    process_id = debugger.GetSelectedTarget().GetProcess().GetUniqueID()
+    if process_id in warmup_done and not warmup_done[process_id].is_set():
+        print("Waiting for the interpreter warm-up to finish")
+        warmup_done[process_id].wait()
+
+def interpreter_status(debugger):
+    """
+    Get the state of the interpreter of the current process ("cold", "warming up", "ready" or "failed")
+    """
+    process_id = debugger.GetSelectedTarget().GetProcess().GetUniqueID()
+    if process_id in warmup_states:
+        return warmup_states[process_id]
+    if process_id in bridge_entry_points and process_id == current_process_id:
+        return "ready"
+    return "cold"
+
+def warmup(debugger, mode):
+    global warmup_enabled
+    warmup_enabled = mode == "on"
+    if warmup_enabled:
+        start_event_listener(debugger)
+        # the process might already be stopped
+        process = debugger.GetSelectedTarget().GetProcess()
+        if process.GetState() == lldb.eStateStopped and interpreter_status(debugger) == "cold":
+            warm_up(debugger, process)
+
+def begin_stats(command):
+    global stats_current
+    stats_current = {"command": command, "start": time.time(), "total": 0.0,
+                     "phases": collections.Counter(), "counters": collections.Counter()}
+
+def end_stats():
+    global stats_current
+    if stats_current is None:
+        return
+    stats_current["total"] = time.time() - stats_current["start"]
+    stats_history.append(stats_current)
+    stats_aggregate["commands"] += 1
+    stats_aggregate["total"] += stats_current["total"]
+    stats_aggregate["phases"].update(stats_current["phases"])
+    stats_aggregate["counters"].update(stats_current["counters"])
+    stats_current = None
+
+@contextlib.contextmanager
+def timed(phase):
+    """
+    Add the wall time of the enclosed code to `phase` of the current command
+    """
+    start = time.time()
+    try:
+        yield
+    finally:
+        add_time(phase, time.time() - start)
+
+def add_time(phase, duration):
+    if stats_current is not None:
+        stats_current["phases"][phase] += duration
+
+def count(counter, n=1):
+    if stats_current is not None:
+        stats_current["counters"][counter] += n
+
+def count_cache(cache, hit):
+    count(cache + (" hits" if hit else " misses"))
+
+def format_stats(stats):
+    lines = ["  phases (ms): " + ", ".join("{} {:.2f}".format(phase, duration*1000)
+                                          for (phase, duration) in stats["phases"].items())]
+    lines.append("  counters: " + ", ".join("{} {}".format(counter, n) for (counter, n) in sorted(stats["counters"].items())))
+    return "\n".join(lines)
+
+def print_stats(options):
+    if options.get("reset"):
+        stats_history.clear()
+        stats_aggregate.update({"commands": 0, "total": 0.0, "phases": collections.Counter(),
+                                "counters": collections.Counter()})
+        return
+    if options.get("json"):
+        print(json.dumps({"recent": list(stats_history), "aggregate": stats_aggregate}, indent=2))
+        return
+
+    print("Recent commands:")
+    for stats in stats_history:
+        print("{} ({:.2f} ms)".format(stats["command"], stats["total"]*1000))
+        print(format_stats(stats))
+    print("Aggregate over {} commands ({:.2f} ms):".format(stats_aggregate["commands"], stats_aggregate["total"]*1000))
+    print(format_stats(stats_aggregate))
+    # hit rates of the caches
+    counters = stats_aggregate["counters"]
+    caches = set(counter.rsplit(" ", 1)[0] for counter in counters if counter.endswith((" hits", " misses")))
+    for cache in sorted(caches):
+        lookups = counters[cache + " hits"] + counters[cache + " misses"]
+        if lookups == 0:
+            continue
+        print("  {}: {:.0f}% hits ({} of {})".format(cache, 100.0*counters[cache + " hits"]/lookups,
+                                                    counters[cache + " hits"], lookups))
+
+def load_bridge(debugger, frame=None):
+    """
+    Load the bridge library into the current process and return the load addresses of its entry points
+
+    The (expensive) loader code is only evaluated once per process, afterwards the resolved addresses are reused.
+    The loader is evaluated in `frame` (by default the selected frame).
+    """
+    target = debugger.GetSelectedTarget()
+    process = target.GetProcess()
+    if process.GetUniqueID() in bridge_entry_points:
+        return bridge_entry_points[process.GetUniqueID()]
+
+    with interpreter_lock, timed("bridge loading"):
+        # the library might have been loaded by another thread while waiting for the lock
+        if process.GetUniqueID() in bridge_entry_points:
+            return bridge_entry_points[process.GetUniqueID()]
+        return _load_bridge(debugger, frame)
+
+def _load_bridge(debugger, frame):
     target = debugger.GetSelectedTarget()
     process = target.GetProcess()
-    thread = process.GetSelectedThread()
-    frame = thread.GetSelectedFrame()
+    if frame is None:
+        frame = process.GetSelectedThread().GetSelectedFrame()
     if not frame.IsValid():
-        print("no frame here")
-        return
-    if process.GetUniqueID() != current_process_id:
-        current_process_id=process.GetUniqueID()
-        load_all_configs(debugger)
-
-    # start a thread that runs until the currently evaluated expression returns.
-    # since the expression is evaluated without any timeout and
-    #  lldb will not interrupt it on ctrl+c we add a signal handler
-    #  that interrupts the currently running expression when ctrl+c is pressed
+        raise NoFrameException()
+
     options = lldb.SBExpressionOptions()
     options.SetTimeoutInMicroSeconds(0) # no timeout
     options.SetUnwindOnError(True)
+    count("lldb expressions")
+    result = frame.EvaluateExpression(bridge_code, options)
+    if not result.GetError().Success():
+        raise BridgeException("Failed to load bridge library: " + str(result.GetError()))
+    handle = result.GetValueAsUnsigned()
+    if handle == 0:
+        raise BridgeException("Failed to load bridge library: dlopen returned a null handle")
+
+    entry_points = {}
+    for name in bridge_functions:
+        # look up the symbol in the loaded module first and only fall back to dlsym if lldb
+        #  has not picked up the library (yet)
+        for symbol_context in target.FindFunctions(name):
+            address = symbol_context.GetSymbol().GetStartAddress().GetLoadAddress(target)
+            if address != lldb.LLDB_INVALID_ADDRESS:
+                entry_points[name] = address
+                break
+        else:
+            count("lldb expressions")
+            address = frame.EvaluateExpression("(void*) dlsym((void*) {:#x}, \"{}\")".format(handle, name), options)
+            if not address.GetError().Success() or address.GetValueAsUnsigned() == 0:
+                raise BridgeException("Failed to load bridge library: entry point `{}` not found".format(name))
+            entry_points[name] = address.GetValueAsUnsigned()
+
+    bridge_entry_points[process.GetUniqueID()] = entry_points
+    return entry_points
+
+def bridge_function(debugger, function, frame=None):
+    """
+    Get a c++ expression for the function pointer to `function` of the bridge library
+    """
+    entry_points = load_bridge(debugger, frame)
+    return "(({type}) {address:#x})".format(type=bridge_functions[function], address=entry_points[function])
+
+def bridge_call(debugger, function, *args, interruptable=True, timeout=None, frame=None):
+    """
+    Call `function` of the bridge library with `args` (strings of c++ expressions) in `frame`
+    (by default the selected frame)
+    """
+    code = bridge_function(debugger, function, frame) + "(" + ", ".join(args) + ")"
+    return lldb_evaluate(debugger, code, interruptable, timeout, frame)
+
+def c_string_literal(string):
+    return "\"" + string.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') + "\""
+
+def prepare_interpreter(debugger):
+    """
+    Load the configs into the interpreter of the current process, the configs of modules loaded
+    since the last command included
+
+    Loading configs evaluates commands itself, so this has to be done at the start of a command
+    before any data is written into the command buffer.
+    """
+    global current_process_id
+    process = debugger.GetSelectedTarget().GetProcess()
+    with interpreter_lock:
+        if process.GetUniqueID() != current_process_id:
+            current_process_id=process.GetUniqueID()
+            with timed("config loading"):
+                load_all_configs(debugger)
+        elif len(pending_modules) > 0:
+            with timed("config loading"):
+                load_pending_module_configs(debugger)
+
+def lldb_evaluate(debugger, code, interruptable=True, timeout=None, frame=None):
+    """
+    Evaluate `code` with lldb's expression evaluator in `frame` (by default the selected frame)
+
+    If `timeout` (in seconds) is given the evaluation is interrupted when it takes longer. An
+    interruptable evaluation can additionally be interrupted by pressing ctrl+c.
+    """
+    if frame is None:
+        frame = debugger.GetSelectedTarget().GetProcess().GetSelectedThread().GetSelectedFrame()
+    if not frame.IsValid():
+        raise NoFrameException()
+
+    # the state of the process is restored if the evaluation fails, times out or is interrupted
+    options = lldb.SBExpressionOptions()
+    options.SetTimeoutInMicroSeconds(int(timeout*1e6) if timeout else 0) # 0: no timeout
+    options.SetUnwindOnError(True)
+    # breakpoint callbacks (e.g. cling break-condition) evaluate commands themselves
+    options.SetIgnoreBreakpoints(True)
+
+    count("lldb expressions")
+    with timed("lldb evaluation"):
+        return _lldb_evaluate(debugger, frame, code, options, interruptable)
 
+def _lldb_evaluate(debugger, frame, code, options, interruptable):
     if interruptable:
+        # evaluate the expression in a separate thread while the main thread waits for it to finish.
+        #  since lldb does not interrupt the expression on ctrl+c itself we check in between if the
+        #  command was interrupted and interrupt the process in that case (the evaluation then
+        #  returns with an error).
+        #  note: InterruptGuard is not used here since replacing lldb's SIGINT handler is not safe
         thread = EvaluationThread(frame, code, options)
-        thread.start() # start the thread
-        # spin until thread finishes and use InterruptGuard to interrupt the process
-        #  when ctrl+c is pressed
-        #with InterruptGuard(debugger) as interrupt_guard:
-        while thread.is_alive():
-            time.sleep(0.05)
+        thread.start()
+        interpreter = debugger.GetCommandInterpreter()
+        interrupted = False
+        while not thread.done.wait(interrupt_check_interval):
+            if not interrupted and interpreter.WasInterrupted():
+                print("Interrupting evaluation")
+                frame.GetThread().GetProcess().SendAsyncInterrupt()
+                interrupted = True
 
         thread.join()
         return thread.result
     else:
         return frame.EvaluateExpression(code, options)
 
+def get_type_cache(debugger):
+    process_id = debugger.GetSelectedTarget().GetProcess().GetUniqueID()
+    if process_id not in type_cache:
+        # a new process has a fresh interpreter
+        type_cache.clear()
+        type_cache[process_id] = {}
+    return type_cache[process_id]
+
+def invalidate_type_cache(debugger):
+    """
+    Forget all types that were not known to the interpreter, e.g. after a header has been included
+    """
+    cache = get_type_cache(debugger)
+    for type_name in [type_name for (type_name, exists) in cache.items() if not exists]:
+        del cache[type_name]
+
+def types_exist(debugger, type_names, frame=None):
+    """
+    Check which of the types in `type_names` are known to the interpreter
+
+    All types not found in the cache are looked up in a single call to the bridge. Returns a
+    dictionary assigning each type name a boolean.
+    """
+    cache = get_type_cache(debugger)
+    for type_name in type_names:
+        if type_name.startswith("(anonymous class)"):
+            cache[type_name] = False
+    missing = list(set(type_name for type_name in type_names if type_name not in cache))
+    if len(type_names) > 0:
+        count("type cache hits", len(set(type_names)) - len(missing))
+        count("type cache misses", len(missing))
+    if len(missing) > 0:
+        code = ("const char* defrustrator_type_names[] = {{{names}}};\n"
+                "{types_exist}(defrustrator_type_names, {count});").format(
+            names=", ".join(c_string_literal(type_name) for type_name in missing),
+            types_exist=bridge_function(debugger, "defrustrator_types_exist", frame),
+            count=len(missing))
+        with timed("type lookup"):
+            result = lldb_evaluate(debugger, code, False, frame=frame)
+        if not result.GetError().Success():
+            raise BridgeException("Looking up types failed ({})".format(result.GetError()))
+        # read the bitmap holding the results
+        error = lldb.SBError()
+        bitmap = debugger.GetSelectedTarget().GetProcess().ReadMemory(result.GetValueAsUnsigned(),
+                                                                      (len(missing)+7)//8, error)
+        if not error.Success():
+            raise BridgeException("Reading the type lookup result failed ({})".format(error))
+        for i, type_name in enumerate(missing):
+            cache[type_name] = bool(bitmap[i//8] & (1 << (i%8)))
+    return {type_name: cache[type_name] for type_name in type_names}
+
 def type_exists(debugger, type_name):
-    if len(type_name)>=17 and type_name[0:17] == "(anonymous class)":
-        return False
-    if type_name in type_cache:
-        return type_cache[type_name]
-    type_name = type_name.replace("\n", "\\n").replace('"', '\\"')
-    result = lldb_evaluate(debugger, "(bool) type_exists(\"" + type_name + "\");", False)
-    assert(result.GetError().Success())
-    if result.GetValue()=="true": # todo: not a clean way to extract the value
-        type_cache[type_name] = True
-    return result.GetValue()=="true"
+    return types_exist(debugger, [type_name])[type_name]
 
 def include_directories(debugger, dirs):
     for dir in dirs:
-        result = lldb_evaluate(debugger, "add_include_path(\"" + dir + "\");")
+        result = bridge_call(debugger, "defrustrator_add_include_path", c_string_literal(dir))
         # todo: add error handling
         #if not result.GetError().Success():
         #    print("Warning: Failed to add to include paths {}".format(dir))
+    invalidate_type_cache(debugger)
+
+def get_variable_address(frame, var):
+    """
+    Get the address of the object referred to by `var` from its metadata
+
+    The expression evaluator is only used as a fallback for values which are available, but whose
+    address lldb can not tell us directly. Returns None if the variable has no address (e.g. it
+    lives in a register or has been optimized out).
+    """
+    # references are bound to the object they refer to
+    if var.GetType().IsReferenceType():
+        var = var.Dereference()
+
+    address = var.GetLoadAddress()
+    if address != lldb.LLDB_INVALID_ADDRESS:
+        return address
+
+    if var.GetError().Fail():
+        print("Warning: variable `{name}` skipped ({error})".format(name=var.GetName(), error=var.GetError()))
+        return None
+
+    # the location of values stored in memory is an address, otherwise it is the name of a register
+    location = var.GetLocation()
+    if location and not location.startswith("0x"):
+        print("Warning: variable `{name}` skipped (stored in register {location})".format(
+            name=var.GetName(), location=location))
+        return None
+
+    address_of = var.AddressOf()
+    if address_of.IsValid() and address_of.GetError().Success() and address_of.GetValueAsUnsigned() != 0:
+        return address_of.GetValueAsUnsigned()
+
+    # slow path: let lldb materialize the value
+    count("lldb expressions")
+    result = frame.EvaluateExpression("&" + var.GetName())
+    if not result.GetError().Success():
+        print("Warning: variable `{name}` skipped (address not available)".format(name=var.GetName()))
+        return None
+    return result.GetValueAsUnsigned()
+
+def get_identifiers(code):
+    """
+    Get the set of all identifiers used in `code`
+    """
+    return set(value for (token_type, value) in CppLexer().get_tokens(code) if token_type in Token.Name)
+
+def is_incomplete(code):
+    """
+    Check whether `code` has unclosed brackets (strings and comments are ignored)
+    """
+    depth = 0
+    for (token_type, value) in CppLexer().get_tokens(code):
+        if token_type in Token.Punctuation or token_type in Token.Operator:
+            depth += sum(value.count(c) for c in "({[") - sum(value.count(c) for c in ")}]")
+    return depth > 0
+
+def line_directive(line, source):
+    """
+    Directive making the interpreter report the following code as line `line` of the file `source`
+    """
+    return "#line {} {}\n".format(line, c_string_literal(source))
+
+# bindings of frame variables declared in the interpreter for the current stop
+stop_bindings = {"key": None, "namespace": None, "names": set()}
+stop_counter = 0
+
+def write_command_buffer(debugger, data, frame=None):
+    """
+    Write `data` (bytes) into the command buffer of the bridge and return its address
+
+    The buffer is allocated by the bridge on first use and only grown if `data` does not fit.
+    """
+    process = debugger.GetSelectedTarget().GetProcess()
+    (address, capacity) = command_buffers.get(process.GetUniqueID(), (0, 0))
+    if len(data) > capacity:
+        capacity = max(len(data), 2*capacity, 4096)
+        result = bridge_call(debugger, "defrustrator_reserve_command_buffer", str(capacity), interruptable=False,
+                             frame=frame)
+        if not result.GetError().Success() or result.GetValueAsUnsigned() == 0:
+            raise BridgeException("Could not allocate command buffer of size {}".format(capacity))
+        address = result.GetValueAsUnsigned()
+        command_buffers[process.GetUniqueID()] = (address, capacity)
+
+    error = lldb.SBError()
+    process.WriteMemory(address, data, error)
+    if not error.Success():
+        raise BridgeException("Could not write command buffer ({})".format(error))
+    return address
+
+def read_result(debugger, size, frame=None):
+    """
+    Read the result of the last command (of `size` bytes) from the result buffer of the bridge
+    """
+    process = debugger.GetSelectedTarget().GetProcess()
+    if process.GetUniqueID() not in result_buffers:
+        result = bridge_call(debugger, "defrustrator_result_buffer", interruptable=False, frame=frame)
+        if not result.GetError().Success():
+            raise BridgeException("Could not locate result buffer ({})".format(result.GetError()))
+        result_buffers[process.GetUniqueID()] = result.GetValueAsUnsigned()
+
+    error = lldb.SBError()
+    data = process.ReadMemory(result_buffers[process.GetUniqueID()], size, error)
+    if not error.Success():
+        raise BridgeException("Could not read result buffer ({})".format(error))
+    (status, diagnostics_size, output_size, output_dropped, compile_ns, execution_ns) = result_header.unpack_from(data)
+    pos = result_header.size
+    diagnostics = data[pos:pos+diagnostics_size].decode("utf-8", "replace")
+    pos += diagnostics_size
+    output = data[pos:pos+output_size].decode("utf-8", "replace")
+    add_time("cling compilation", compile_ns*1e-9)
+    add_time("cling execution", execution_ns*1e-9)
+    return CommandResult(status, diagnostics, output, output_dropped, compile_ns*1e-9, execution_ns*1e-9)
+
+def send_command(debugger, code, timeout=None, frame=None):
+    """
+    Send `code` to the interpreter and return its result (evaluating the bridge calls in `frame`)
+    """
+    # the code is transferred verbatim through the command buffer such that lldb does not have
+    #  to parse (and we do not have to escape) it
+    data = code.encode("utf-8")
+    count("bytes sent to the interpreter", len(data))
+    address = write_command_buffer(debugger, data, frame)
+    result = bridge_call(debugger, "defrustrator_send_command", "(const char*) {:#x}".format(address), str(len(data)),
+                         timeout=timeout, frame=frame)
+    if not result.GetError().Success():
+        raise BridgeException("Sending command failed ({})".format(result.GetError()))
+    return read_result(debugger, result.GetValueAsUnsigned(), frame)
+
+def print_result(result):
+    """
+    Print diagnostics and output of a command evaluated by the interpreter
+    """
+    sys.stdout.write(result.diagnostics)
+    if result.output_dropped > 0:
+        print("Note: the first {} bytes of the output were dropped".format(result.output_dropped))
+    sys.stdout.write(result.output)
+    if result.status == 1:
+        print("Compilation failed")
+    elif result.status == 2:
+        print("More input expected")
+    elif result.status == 3:
+        print("Exception thrown")
+
+def get_bindings(debugger, frame, scope, vars):
+    """
+    Return name, type and address of all variables `vars` of `frame` (with scope `scope`) the
+    interpreter knows the type of
+    """
+    # collect addresses and types of all variables and check in one go which types the interpreter knows
+    bindings = []
+    for (name, var) in vars.items():
+        if var == "this":
+            print("Note: variable `this` skipped")
+
+        with timed("address resolution"):
+            address = get_variable_address(frame, var)
+        if address is None:
+            continue
 
-def eval_expr(debugger, code, options={}):
+        with timed("type strings"):
+            bindings.append((name, scope.get_type_str(var), address))
+    known_types = types_exist(debugger, [var_type for (_, var_type, _) in bindings], frame)
+
+    known_bindings = []
+    for (name, var_type, address) in bindings:
+        if known_types[var_type]:
+            # remove reference qualifier
+            if var_type[-1]=="&":
+                var_type=var_type[:-1]
+            known_bindings.append((name, var_type, address))
+        else:
+            print("Warning: variable `{name}` with type `{type}` skipped".format(name=name, type=var_type))
+    return known_bindings
+
+def binding_declaration(name, var_type, address):
+    """
+    Declaration of a reference `name` to the variable of type `var_type` at `address` (a void* expression)
+    """
+    #  note that the following code lead to severe problems if compilation failed (i.e. when an
+    #  undeclared identifier has been used)
+    #  "std::add_lvalue_reference<{type}>::type {name} = "
+    return ("{type}& {name} = "
+            "*reinterpret_cast<std::remove_reference<{type}>::type*>({address});\n").format(
+                name=name, type=var_type, address=address)
+
+def get_stop_bindings(debugger, frame, scope, vars):
+    """
+    Make the variables `vars` of `frame` (with scope `scope`) accessible in the interpreter
+
+    The variables are declared as references inside a namespace unique to the current stop (and
+    frame) such that consecutive commands only have to import them instead of declaring them
+    again. Returns the name of the namespace and the names of all variables bound in it or None
+    if the declaration failed.
+    """
+    global stop_counter
+    process = frame.GetThread().GetProcess()
+    key = (process.GetUniqueID(), process.GetStopID(), frame.GetCFA(), frame.GetPC())
+    if stop_bindings["key"] != key:
+        stop_counter += 1
+        stop_bindings["key"] = key
+        stop_bindings["namespace"] = "__defr_stop_{}".format(stop_counter)
+        stop_bindings["names"] = set()
+
+    # write wrapper code making variables accessible
+    bindings = get_bindings(debugger, frame, scope, {name: var for (name, var) in vars.items()
+                                              if name not in stop_bindings["names"]})
+    wrapper_code = "".join(binding_declaration(name, var_type, "(void*){:#x}".format(address))
+                           for (name, var_type, address) in bindings)
+    bound_names = [name for (name, _, _) in bindings]
+
+    if len(bound_names) > 0:
+        code = ("namespace {namespace} {{\n"
+                "{wrapper_code}"
+                "}}").format(namespace=stop_bindings["namespace"], wrapper_code=wrapper_code)
+        result = send_command(debugger, code)
+        if result.status != 0:
+            print_result(result)
+            print("Declaration of frame variables failed")
+            return None
+        stop_bindings["names"].update(bound_names)
+
+    return stop_bindings["namespace"], [name for name in vars if name in stop_bindings["names"]]
+
+def eval_expr(debugger, code, options={}, print_output=True, source=None):
     """
     Evaluate `code` in cling interpreter
+
+    The output is only printed if `print_output` is set, diagnostics are always printed. If `code`
+    comes from a file, `source` is its name such that diagnostics refer to the lines of the file.
     """
     default_options = {
-        "global": False
+        "global": False,
+        "all-variables": False,
+        "timeout": None
     }
     default_options.update(options)
     options = default_options
@@ -202,91 +869,241 @@ def eval_expr(debugger, code, options={}):
     if not frame.IsValid():
         raise NoFrameException()
 
-    # todo: test that everything works correctly when the frame changes and both frames contain the same variables
-    wrapper_code = ""
-
-    # todo: test that only the inner most variable is used (SBValue::IsInScope?)
     if not options["global"]:
-        # compute for each variable a number describing it's depth in terms of blocks
-        # i.e. a variable in the current block has depth 0, one in the parent block depth 1 and so on
-
-        # fetch all blocks
-        blocks = []
-        current_block = frame.GetBlock()
-        while current_block.IsValid():
-            blocks.append(current_block)
-            current_block = current_block.GetParent()
-        # get variables in each block
-        blocks_vars = map(lambda block: block.GetVariables(frame, True, True, False, True), blocks)
-        # dictionary assigning each variable (key is an id) a depth
-        var_depths = {}
-        # iterate over all variables
-        for var in frame.GetVariables(True, True, False, True):
-            # set depth to maximum integer value in the beginning since global variable will not be found in any block
-            var_depths[var.GetID()] = 2147483647
-            for i, block_vars in enumerate(blocks_vars):
-                for block_var in block_vars:
-                    if var.GetID() == block_var.GetID():
-                        var_depths[var.GetID()] = i
-        # dictionary assigning each variable name an array containing it's depth and an SBValue objects
-        vars = {}
-        for var in frame.GetVariables(True, True, False, True):
-            if not var.GetName():
-                continue
-            if not var.GetName() in vars:
-                vars[var.GetName()] = (var_depths[var.GetID()], var)
-            else:
-                if var_depths[var.GetID()] < vars[var.GetName()][0]:
-                    vars[var.GetName()] = (var_depths[var.GetID()], var)
-
-        # write wrapper code making variables accessible
-        for (_, (depth, var)) in vars.items():
-            address = frame.EvaluateExpression("&"+var.GetName()).GetValue()
-            if var == "this":
-                print("Note: variable `this` skipped")
-
-            var_type = get_type_str(var.GetType())
-            if type_exists(debugger, var_type):
-                # remove reference qualifier
-                #  note that the following code lead to severe problems if compilation failed (i.e. when an
-                #  undeclared identifier has been used)
-                #  "std::add_lvalue_reference<{type}>::type {name} = "
-                if var_type[-1]=="&":
-                    var_type=var_type[:-1]
-                wrapper_code += ("{type}& {name} = "
-                                "*reinterpret_cast<std::remove_reference<{type}>::type*>((void*){address});\n") \
-                    .format(name=var.GetName(), type=var_type, address=address)
-            else:
-                print("Warning: variable `{name}` with type `{type}` skipped".format(name=var.GetName(), type=var_type))
-
-        code = ("{{\n"
-                "  // Wrapper code\n"
-                "  {wrapper_code}\n"
-                "  // Code\n"
-                "  {code}\n"
-                "}}").format(wrapper_code=wrapper_code, code=code)
-
-    # escape characters
-    code = code.replace("\n", "\\n").replace('"', '\\"')
-
-    # send code to the interpreter
-    result = lldb_evaluate(debugger, "send_command(\"" + code + "\");")
-
-    # check the compilation result
-    compilation_result = frame.EvaluateExpression("(int) defrustrator_get_last_compilation_result()").GetValue()
-    if compilation_result == "0":
-        pass
-    elif compilation_result == "1":
-        print("Compilation failed")
-    elif compilation_result == "2":
-        print("More input expected")
-    else:
-        raise Exception()
+        with timed("variable discovery"):
+            scope, vars = get_scope_and_variables(frame)
+
+        # only bind variables that are actually used in the code unless explicitly requested otherwise
+        if not options["all-variables"]:
+            identifiers = get_identifiers(code)
+            vars = {name: var for (name, var) in vars.items() if name in identifiers}
+
+        bindings = get_stop_bindings(debugger, frame, scope, vars)
+        if bindings is None:
+            return CommandResult(1, "", "", 0, 0.0, 0.0)
+        namespace, names = bindings
+
+        # import the variables into the block the code is evaluated in
+        #  using declarations are used (instead of a using directive) such that the
+        #  variables shadow equally named variables in the global scope of the interpreter
+        wrapper_code = "".join("using {namespace}::{name};\n".format(namespace=namespace, name=name)
+                               for name in names)
+
+        # the time execution starts is recorded to separate it from the compilation time
+        prefix = ("{{\n"
+                  "  Defrustrator::mark_execution();\n"
+                  "  // Wrapper code\n"
+                  "  {wrapper_code}\n"
+                  "  // Code\n").format(wrapper_code=wrapper_code)
+        code = prefix + (line_directive(1, source) if source is not None else "") + code + "\n}"
+    elif source is not None:
+        code = line_directive(1, source) + code
+
+    # send code to the interpreter and check the compilation result
+    timeout = float(options["timeout"]) if options["timeout"] else None
+    result = send_command(debugger, code, timeout)
+    print_result(result if print_output else result._replace(output="", output_dropped=0))
+    # declarations in global scope may have made new types available
+    if result.status == 0 and options["global"]:
+        invalidate_type_cache(debugger)
+        # and expressions that failed to compile may compile now
+        for (key, function_id) in list(compiled_expressions.items()):
+            if function_id is None:
+                del compiled_expressions[key]
 
     return result
 
+def get_compiled_function(debugger, frame, code, bindings):
+    """
+    Return the id of the function evaluating `code` with the variables `bindings`, compiling it on first use
+
+    The function takes the addresses of the variables as arguments, such that it can be called at every
+    stop. It is cached by the code and the names and types of the variables. Returns None if the code
+    could not be compiled.
+    """
+    global compiled_counter
+    process = frame.GetThread().GetProcess()
+    key = (process.GetUniqueID(), code, tuple((name, var_type) for (name, var_type, _) in bindings))
+    count_cache("compiled expression cache", key in compiled_expressions)
+    if key not in compiled_expressions:
+        compiled_counter += 1
+        function_code = ("void __defr_compiled_{id}(void** __defr_args) {{\n"
+                         "{declarations}"
+                         "  {code}\n"
+                         "}}\n"
+                         "Defrustrator::register_compiled({id}, &__defr_compiled_{id});").format(
+            id=compiled_counter, code=code,
+            declarations="".join("  " + binding_declaration(name, var_type, "__defr_args[{}]".format(i))
+                                 for (i, (name, var_type, _)) in enumerate(bindings)))
+        result = send_command(debugger, function_code, frame=frame)
+        compiled_expressions[key] = compiled_counter if result.status == 0 else None
+    return compiled_expressions[key]
+
+def compile_code(debugger, frame, code, options={}):
+    """
+    Compile `code` into a function for the variables of `frame` it uses
+
+    Returns the id of the function and the variables to pass (see `get_compiled_function`) or None if
+    the code could not be compiled.
+    """
+    bindings = []
+    if not options.get("global", False):
+        with timed("variable discovery"):
+            scope, vars = get_scope_and_variables(frame)
+        if not options.get("all-variables", False):
+            identifiers = get_identifiers(code)
+            vars = {name: var for (name, var) in vars.items() if name in identifiers}
+        bindings = get_bindings(debugger, frame, scope, vars)
+
+    function_id = get_compiled_function(debugger, frame, code, bindings)
+    if function_id is None:
+        return None
+    return function_id, bindings
+
+def call_compiled(debugger, frame, compiled, options={}, interruptable=True):
+    """
+    Call the function `compiled` (as returned by `compile_code`) and return the result
+    """
+    (function_id, bindings) = compiled
+    process = frame.GetThread().GetProcess()
+    pointer_format = "Q" if process.GetAddressByteSize() == 8 else "I"
+    args = struct.pack("={}{}".format(len(bindings), pointer_format), *[address for (_, _, address) in bindings])
+    address = write_command_buffer(debugger, args if len(args) > 0 else bytes(1), frame)
+    timeout = float(options["timeout"]) if options.get("timeout") else None
+    result = bridge_call(debugger, "defrustrator_call_compiled", str(function_id), "(void**) {:#x}".format(address),
+                         interruptable=interruptable, timeout=timeout, frame=frame)
+    if not result.GetError().Success():
+        raise BridgeException("Calling compiled expression failed ({})".format(result.GetError()))
+    return read_result(debugger, result.GetValueAsUnsigned(), frame)
+
+def eval_compiled(debugger, frame, code, options={}, interruptable=True):
+    """
+    Evaluate `code` in `frame` by calling a function compiled from it
+
+    Compared to `eval_expr` the code is only compiled once for all stops (see `get_compiled_function`),
+    later evaluations only pass the addresses of the variables. Returns the result (which is not
+    printed) or None if the code could not be compiled.
+    """
+    compiled = compile_code(debugger, frame, code, options)
+    if compiled is None:
+        return None
+    return call_compiled(debugger, frame, compiled, options, interruptable)
+
+def set_break_condition(debugger, breakpoint_id, code):
+    """
+    Only stop at breakpoint `breakpoint_id` if `code` evaluates to true (any condition is removed if `code` is empty)
+    """
+    breakpoint = debugger.GetSelectedTarget().FindBreakpointByID(breakpoint_id)
+    if not breakpoint.IsValid():
+        print("Error: no breakpoint with id {}".format(breakpoint_id))
+        return
+    if code == "":
+        breakpoint_conditions.pop(breakpoint_id, None)
+        return
+    breakpoint_conditions[breakpoint_id] = code
+    breakpoint.SetScriptCallbackFunction("defrustrator.breakpoint_condition")
+
+def breakpoint_condition(frame, bp_loc, internal_dict):
+    """
+    Breakpoint callback evaluating the condition set by `set_break_condition`, returns whether to stop
+    """
+    code = breakpoint_conditions.get(bp_loc.GetBreakpoint().GetID())
+    if code is None:
+        return True
+    debugger = frame.GetThread().GetProcess().GetTarget().GetDebugger()
+    try:
+        prepare_interpreter(debugger)
+        # the breakpoint callback already holds lldb's api lock, so the evaluation can't run in a thread
+        result = eval_compiled(debugger, frame,
+                               "Defrustrator::output() << (static_cast<bool>(" + code + ") ? 1 : 0);",
+                               interruptable=False)
+    except (NoFrameException, BridgeException) as e:
+        print("Error: {}".format(e))
+        return True
+    if result is None or result.status != 0:
+        if result is not None:
+            print_result(result)
+        print("Error: breakpoint condition `{}` could not be evaluated, stopping".format(code))
+        return True
+    return result.output.strip() == "1"
+
+def split_template_name(name):
+    """
+    Split the type name `name` into the template name and its (top level) template arguments
+
+    The arguments of the last template argument list are returned, i.e. the ones of `B` for
+    `A<int>::B<3>`. Returns (name, None) if `name` does not end with a template argument list.
+    e.g. `Ns::A<int, B<char, 2>, 3>` is split into `Ns::A` and [`int`, `B<char, 2>`, `3`].
+    """
+    if not name.endswith(">"):
+        return name, None
+    args = []
+    depth = 0
+    parentheses = 0
+    arg_end = len(name)-1
+    # scan backwards from the closing bracket to the matching opening bracket
+    for pos in range(len(name)-1, -1, -1):
+        c = name[pos]
+        if c == ")":
+            parentheses += 1
+        elif c == "(":
+            parentheses -= 1
+        elif parentheses > 0:
+            continue
+        elif c == ">":
+            depth += 1
+        elif c == "<":
+            depth -= 1
+            if depth == 0:
+                args.append(name[pos+1:arg_end].strip())
+                args.reverse()
+                return name[0:pos], args
+        elif c == "," and depth == 1:
+            args.append(name[pos+1:arg_end].strip())
+            arg_end = pos
+    return name, None
+
+def fix_template_args(sbtype, name):
+    """
+    Fix template arguments of type int that lldb reports as unsigned int in `name`, the (canonical)
+    name of `sbtype`, on all nesting levels
+    """
+    (template_name, args) = split_template_name(name)
+    if args is None or len(args) != sbtype.GetNumberOfTemplateArguments():
+        return name
+    for i in range(len(args)):
+        arg_type = sbtype.GetTemplateArgumentType(i)
+        if not arg_type.IsValid():
+            continue
+        if re.match(r"^\d+$", args[i]):
+            # value argument: if it has type int and a value higher than std::numeric_limits<int>::max()
+            #  it was wrongly parsed as an unsigned int
+            if arg_type == arg_type.GetBasicType(lldb.eBasicTypeInt) and int(args[i]) >= 2**31:
+                args[i] = str(ctypes.c_int(int(args[i])).value)
+        elif arg_type.GetNumberOfTemplateArguments() > 0:
+            args[i] = fix_template_args(arg_type.GetCanonicalType(), args[i])
+    return template_name + "<" + ", ".join(args) + ">"
+
+# type strings keyed by the module of the type, its name and the names of the types it refers to
+type_str_cache = {}
+
 def get_type_str(raw_type):
     assert(isinstance(raw_type, lldb.SBType))
+    # older versions of lldb do not tell us the module of a type
+    module = raw_type.GetModule() if hasattr(raw_type, "GetModule") else None
+    # the name is not unique (pointers to Ns::Type and Other::Type are both named Type*), the type
+    #  string is resolved using the inner most pointee and the canonical type (function pointers)
+    unwrapped_type = raw_type
+    while unwrapped_type.IsPointerType():
+        unwrapped_type = unwrapped_type.GetPointeeType()
+    key = (str(module.GetFileSpec()) if module is not None and module.IsValid() else None, raw_type.GetName(),
+           unwrapped_type.GetUnqualifiedType().GetName(), raw_type.GetCanonicalType().GetName())
+    count_cache("type string cache", key in type_str_cache)
+    if key not in type_str_cache:
+        type_str_cache[key] = _get_type_str(raw_type)
+    return type_str_cache[key]
+
+def _get_type_str(raw_type):
     # this is a really nasty fix for the fact that lldb only gives
     #  us Type* even if we have Ns::Type*, but since we need the full
     #  type we strip of all qualifiers replace Type with Ns::Type
@@ -298,10 +1115,10 @@ def get_type_str(raw_type):
     if raw_type.IsPointerType() and raw_type.GetPointeeType().IsFunctionType():
         func_type = raw_type.GetPointeeType()
         # get the correct type string for the return type and all arguments
-        return_type = get_type_str(raw_type.GetPointeeType().GetFunctionReturnType())
+        return_type = get_type_str(func_type.GetFunctionReturnType())
         # get correct type string for all arguments
         argument_types = []
-        for arg in raw_type.GetPointeeType().GetFunctionArgumentTypes():
+        for arg in func_type.GetFunctionArgumentTypes():
             argument_types.append(get_type_str(arg))
         return return_type + "(*)(" + ", ".join(argument_types) + ")"
 
@@ -309,6 +1126,7 @@ def get_type_str(raw_type):
     unwrapped_type = raw_type
     while unwrapped_type.IsPointerType():
         unwrapped_type = unwrapped_type.GetPointeeType()
+    unwrapped_type_name = unwrapped_type.GetName()
 
     # workarround for a bug in lldb where template parameters of
     #  type int are parsed as an unsigned int
@@ -316,78 +1134,377 @@ def get_type_str(raw_type):
     #  and we have some template parameters we check if they are of type
     #  int and have a value higher than std::numeric_limits<int>::max()
     #  we fix the template parameter
-    if unwrapped_type.GetCanonicalType().GetName() == unwrapped_type.GetName() and unwrapped_type.GetNumberOfTemplateArguments() > 0:
+    if unwrapped_type.GetNumberOfTemplateArguments() > 0:
         canonical_unwrapped_type = unwrapped_type.GetCanonicalType()
-        canonical_unwrapped_type_name = canonical_unwrapped_type.GetName()
-        # first get the name of the type without template arguments
-        class_name = re.sub(r"(.*?)<(.*)", r"\1", unwrapped_type.GetCanonicalType().GetName())
-        # get all template arguments (for value arguments we want the value not the type)
-        tpl_args = []
-        arg_begin=canonical_unwrapped_type_name.find('<')+1
-        depth=0
-        for pos in range(0, len(canonical_unwrapped_type_name)):
-            if canonical_unwrapped_type_name[pos] == "<":
-                depth += 1
-            if canonical_unwrapped_type_name[pos] == ">":
-                depth -= 1
-            if canonical_unwrapped_type_name[pos] == "," and depth == 1:
-                tpl_args.append(canonical_unwrapped_type_name[arg_begin:pos])
-                arg_begin = pos+1
-            if canonical_unwrapped_type_name[pos] == ">" and depth == 0:
-                tpl_args.append(canonical_unwrapped_type_name[arg_begin:pos])
-                depth-=1
-                break
-        #print(canonical_unwrapped_type_name)
-        #print(tpl_args)
-        #tpl_args = canonical_unwrapped_type.GetName()[len(class_name)+1:-1].split(',') # here we want the value
-        tpl_args_type = unwrapped_type.template_args # here we want the type
-        assert(len(tpl_args) == canonical_unwrapped_type.GetNumberOfTemplateArguments())
-
-        # todo: this is not very generic yet
-        for i in range(len(tpl_args)):
-            arg = tpl_args[i].strip()
-            typ = tpl_args_type[i]
-            if arg != "int" and typ == typ.GetBasicType(lldb.eBasicTypeInt) and int(arg)>=2**31:
-                tpl_args[i] = ctypes.c_int(int(arg)).value
-
-        return class_name + "<" + ", ".join(str(a) for a in tpl_args) + ">"
+        if canonical_unwrapped_type.GetName() == unwrapped_type_name:
+            fixed_name = fix_template_args(canonical_unwrapped_type, unwrapped_type_name)
+            # put the pointers (and their qualifiers) on again
+            raw_type_name = raw_type.GetName()
+            if raw_type_name.startswith(unwrapped_type_name):
+                return fixed_name + raw_type_name[len(unwrapped_type_name):]
+            return fixed_name
 
     # check wether we can find the unqualified name of type of the "inner most" pointee
     #  if that is not the case we assume that we have we've got something
     #  like Ns::Type in the inner most type but only Type* one level higher 
     #  as such we replace Type with Ns::Type
-    if not re.search(re.escape(unwrapped_type.GetUnqualifiedType().GetName()), raw_type.GetName()):
-        stripped_inner_most = re.sub(".*?([^:]+)$", r"\1", unwrapped_type.GetUnqualifiedType().GetName())
-        return re.sub(re.escape(stripped_inner_most), unwrapped_type.GetUnqualifiedType().GetName(), raw_type.GetName())
+    unqualified_name = unwrapped_type.GetUnqualifiedType().GetName()
+    if not re.search(re.escape(unqualified_name), raw_type.GetName()):
+        stripped_inner_most = re.sub(".*?([^:]+)$", r"\1", unqualified_name)
+        return re.sub(re.escape(stripped_inner_most), unqualified_name, raw_type.GetName())
 
     return raw_type.GetName() # fallback
 
+def get_declaration_key(var):
+    """
+    Identify the variable `var` by its declaration
+
+    Unlike `SBValue.GetID()`, which is unique to the value object and as such to the frame, the
+    declaration is the same for all frames (and processes) of the same function.
+    """
+    declaration = var.GetDeclaration()
+    if not declaration.IsValid():
+        return (var.GetName(), None, 0, 0)
+    return (var.GetName(), str(declaration.GetFileSpec()), declaration.GetLine(), declaration.GetColumn())
+
+class Scope:
+    """
+    Variables visible in a lexical scope of the debugged program, i.e. a function, block and pc range
+    """
+    def __init__(self, declarations):
+        # declaration (see get_declaration_key) of the inner most variable with a given name
+        self.declarations = declarations
+        # type strings of the variables keyed by their declaration
+        self.type_strs = {}
+
+    def get_type_str(self, var):
+        key = get_declaration_key(var)
+        if key not in self.type_strs:
+            self.type_strs[key] = get_type_str(var.GetType())
+        return self.type_strs[key]
+
+# scopes keyed by the module, function and address ranges of the inner most block
+scope_cache = {}
+# variables of the frame the last command was evaluated in
+frame_variables_cache = {"key": None, "scope": None, "variables": None}
+
+def get_scope_key(frame):
+    # file addresses are used since they are the same for every process of the same executable
+    block = frame.GetBlock()
+    block_ranges = tuple((block.GetRangeStartAddress(i).GetFileAddress(), block.GetRangeEndAddress(i).GetFileAddress())
+                         for i in range(block.GetNumRanges()))
+    return (str(frame.GetModule().GetFileSpec()), frame.GetFunction().GetStartAddress().GetFileAddress(),
+            block_ranges)
+
+def get_scope(frame):
+    """
+    Get the scope of `frame`, analyzing the blocks of the frame if it has not been seen before
+    """
+    key = get_scope_key(frame)
+    count_cache("scope cache", key in scope_cache)
+    if key in scope_cache:
+        return scope_cache[key]
+
+    # compute for each variable a number describing it's depth in terms of blocks
+    # i.e. a variable in the current block has depth 0, one in the parent block depth 1 and so on
+    var_depths = {}
+    depth = 0
+    current_block = frame.GetBlock()
+    while current_block.IsValid():
+        for block_var in current_block.GetVariables(frame, True, True, False, True):
+            decl_key = get_declaration_key(block_var)
+            if decl_key not in var_depths:
+                var_depths[decl_key] = depth
+        current_block = current_block.GetParent()
+        depth += 1
+
+    # find the inner most variable for each name
+    #  global variables are not found in any block and as such get the maximum depth
+    vars = {}
+    for var in frame.GetVariables(True, True, False, True):
+        if not var.GetName():
+            continue
+        decl_key = get_declaration_key(var)
+        depth = var_depths.get(decl_key, 2147483647)
+        if not var.GetName() in vars or depth < vars[var.GetName()][0]:
+            vars[var.GetName()] = (depth, decl_key)
+
+    scope = Scope({name: decl_key for (name, (_, decl_key)) in vars.items()})
+    scope_cache[key] = scope
+    return scope
+
+def get_scope_and_variables(frame):
+    """
+    Get the scope of `frame` and a dictionary assigning the name of each variable visible in
+    `frame` its SBValue
+
+    The result is reused for all commands issued at the same stop.
+    """
+    process = frame.GetThread().GetProcess()
+    key = (process.GetUniqueID(), process.GetStopID(), frame.GetCFA(), frame.GetPC())
+    count_cache("frame variables cache", frame_variables_cache["key"] == key)
+    if frame_variables_cache["key"] == key:
+        return frame_variables_cache["scope"], frame_variables_cache["variables"]
+
+    # the values of this frame are matched with the variables of the scope by their declarations
+    scope = get_scope(frame)
+    variables = {var.GetName(): var for var in frame.GetVariables(True, True, False, True)
+                 if var.GetName() and scope.declarations.get(var.GetName()) == get_declaration_key(var)}
+
+    frame_variables_cache["key"] = key
+    frame_variables_cache["scope"] = scope
+    frame_variables_cache["variables"] = variables
+    return scope, variables
+
+def get_frame_variables(frame):
+    """
+    Get a dictionary assigning the name of each variable visible in `frame` its SBValue
+    """
+    return get_scope_and_variables(frame)[1]
+
 def get_variables(debugger):
     """Get all variables visible in the current frame"""
     frame = debugger.GetSelectedTarget().GetProcess().GetSelectedThread().GetSelectedFrame()
     if not frame.IsValid():
         raise NoFrameException()
 
-    # todo: test that only the inner most variable is used (SBValue::IsInScope?)
-    variables = {}
-    for var in frame.GetVariables(True, True, False, True):
-        variables[var.GetName()] = var
+    return get_frame_variables(frame)
+
+class NameIndex:
+    """
+    Names answering prefix queries by bisection, `names` have to be sorted and unique
+    """
+    def __init__(self, names=()):
+        self.names = names
+
+    def complete(self, prefix, limit=200):
+        start = bisect.bisect_left(self.names, prefix)
+        end = bisect.bisect_left(self.names, prefix + "\U0010ffff")
+        return self.names[start:min(end, start+limit)]
+
+def cling_names_path():
+    """
+    Path of the cached names declared by the configs of the current interpreter
+    """
+    cling_version = [file_signature(base_path + "/bin/cling/lib/libcling.so"),
+                     file_signature(base_path + "/build/liblldbclingbridge.so")]
+    key = hashlib.sha256(json.dumps([[(conf_path, file_signature(conf_path)) for conf_path in interpreter_configs],
+                                     cling_version]).encode("utf-8")).hexdigest()
+    return os.path.join(completion_path, "cling-" + key + ".json")
+
+def get_cling_names(debugger, refresh=False):
+    """
+    Get the (sorted) names declared in the interpreter
+
+    The names only depend on the configs the interpreter was created with, so they are cached on
+    disk. With `refresh` they are queried from the interpreter (e.g. after including headers) and
+    not cached.
+    """
+    if not refresh and os.path.isfile(cling_names_path()):
+        with open(cling_names_path(), "r") as names_file:
+            return json.load(names_file)
+
+    result = bridge_call(debugger, "defrustrator_declared_names", interruptable=False)
+    if not result.GetError().Success():
+        raise BridgeException("Querying declared names failed ({})".format(result.GetError()))
+    names_result = read_result(debugger, result.GetValueAsUnsigned())
+    names = names_result.output.split()
+    if names_result.output_dropped > 0:
+        # the output buffer only kept the last names, the first of them may be cut off
+        print("Warning: not all declared names fit into the output buffer, completion is incomplete")
+        names = names[1:]
+    names = sorted(set(names))
+    if not refresh and names_result.output_dropped == 0:
+        os.makedirs(completion_path, exist_ok=True)
+        with open(cling_names_path(), "w") as names_file:
+            json.dump(names, names_file)
+    return names
+
+def get_member_index(uuid):
+    """
+    Get the member names of the types of the module with build-id `uuid`, loaded from disk on first use
+    """
+    if uuid not in member_indexes:
+        member_indexes[uuid] = {}
+        index_path = os.path.join(completion_path, "members-" + uuid + ".json")
+        if uuid != "" and os.path.isfile(index_path):
+            with open(index_path, "r") as index_file:
+                member_indexes[uuid] = json.load(index_file)
+    return member_indexes[uuid]
+
+def save_member_indexes():
+    for uuid in dirty_member_indexes:
+        if uuid == "":
+            continue
+        os.makedirs(completion_path, exist_ok=True)
+        with open(os.path.join(completion_path, "members-" + uuid + ".json"), "w") as index_file:
+            json.dump(member_indexes[uuid], index_file)
+    dirty_member_indexes.clear()
+
+def value_type(sbtype):
+    """
+    Type of the object `sbtype` refers or points to
+    """
+    while sbtype.IsPointerType() or sbtype.IsReferenceType():
+        sbtype = sbtype.GetPointeeType() if sbtype.IsPointerType() else sbtype.GetDereferencedType()
+    return sbtype.GetCanonicalType()
+
+def get_type_members(sbtype):
+    """
+    Get the sorted names of the fields and member functions of `sbtype` including those of its base classes
+    """
+    sbtype = value_type(sbtype)
+    # older versions of lldb do not tell us the module of a type
+    module = sbtype.GetModule() if hasattr(sbtype, "GetModule") else None
+    uuid = module.GetUUIDString() if module is not None and module.IsValid() else ""
+    index = get_member_index(uuid)
+    name = sbtype.GetName()
+    if name not in index:
+        members = set(sbtype.GetFieldAtIndex(i).GetName() for i in range(sbtype.GetNumberOfFields()))
+        members.update(sbtype.GetMemberFunctionAtIndex(i).GetName()
+                       for i in range(sbtype.GetNumberOfMemberFunctions()))
+        for i in range(sbtype.GetNumberOfDirectBaseClasses()):
+            members.update(get_type_members(sbtype.GetDirectBaseClassAtIndex(i).GetType()))
+        index[name] = sorted(member for member in members if member and not member.startswith("~"))
+        dirty_member_indexes.add(uuid)
+    return index[name]
+
+def get_field_type(sbtype, name):
+    """
+    Get the type of the field `name` of `sbtype` (or one of its base classes), None if there is none
+    """
+    sbtype = value_type(sbtype)
+    for i in range(sbtype.GetNumberOfFields()):
+        if sbtype.GetFieldAtIndex(i).GetName() == name:
+            return sbtype.GetFieldAtIndex(i).GetType()
+    for i in range(sbtype.GetNumberOfDirectBaseClasses()):
+        field_type = get_field_type(sbtype.GetDirectBaseClassAtIndex(i).GetType(), name)
+        if field_type is not None:
+            return field_type
+    return None
 
-    return variables
+class ReplCompleter(Completer):
+    """
+    Complete names of variables, their members (e.g. `a.b->c`) and names declared in the interpreter
+    """
+    member_access = re.compile(r"([A-Za-z_]\w*(?:\s*(?:\.|->)\s*[A-Za-z_]\w*)*)\s*(?:\.|->)\s*(\w*)$")
+    identifier = re.compile(r"[A-Za-z_][\w:]*$")
+
+    def __init__(self, variables, names):
+        self.variables = variables
+        self.variable_names = NameIndex(sorted(variables))
+        self.names = NameIndex(names)
+
+    def get_completions(self, document, complete_event):
+        text = document.text_before_cursor
+        match = self.member_access.search(text)
+        if match is not None:
+            path = re.split(r"\s*(?:\.|->)\s*", match.group(1))
+            prefix = match.group(2)
+            var = self.variables.get(path[0])
+            if var is None:
+                return
+            sbtype = var.GetType()
+            for name in path[1:]:
+                sbtype = get_field_type(sbtype, name)
+                if sbtype is None:
+                    return
+            candidates = [member for member in get_type_members(sbtype) if member.startswith(prefix)]
+        else:
+            match = self.identifier.search(text)
+            if match is None:
+                return
+            prefix = match.group(0)
+            candidates = sorted(set(self.variable_names.complete(prefix) + self.names.complete(prefix)))
+        for candidate in candidates:
+            yield Completion(candidate, start_position=-len(prefix))
 
 def repl(debugger, options):
+    frame = debugger.GetSelectedTarget().GetProcess().GetSelectedThread().GetSelectedFrame()
+    if not frame.IsValid():
+        raise NoFrameException()
+    variables = {} if options.get("global", False) else get_frame_variables(frame)
+    completer = ReplCompleter(variables, get_cling_names(debugger))
+
     # read input and evaluate commands
+    pending = ""
     try:
         history = FileHistory(history_file)
         while True:
-            # read command
-            cmd = prompt(u"(cling) ", lexer=PygmentsLexer(CppLexer), history=history)
-            # evaluate command
-            eval_expr(debugger, cmd, options)
+            # read command, incomplete commands are continued on the next line
+            cmd = prompt(u"(cling) " if pending == "" else u"(cling) ... ", lexer=PygmentsLexer(CppLexer),
+                         history=history, completer=completer)
+            if pending == "" and cmd.strip() == ".paste":
+                print("Paste mode, evaluate with Esc+Enter")
+                cmd = prompt(u"", multiline=True, lexer=PygmentsLexer(CppLexer), completer=completer)
+                result = eval_source(debugger, cmd, "<paste>", options)
+            else:
+                cmd = pending + cmd
+                if is_incomplete(cmd):
+                    pending = cmd + "\n"
+                    continue
+                # evaluate command
+                result = eval_expr(debugger, cmd, options)
+                pending = cmd + "\n" if result.status == 2 else ""
+            # included headers and loaded libraries declare new names
+            if result.status == 0 and ("#include" in cmd or "#pragma" in cmd):
+                completer.names = NameIndex(get_cling_names(debugger, refresh=True))
     except KeyboardInterrupt:
         1
     finally:
-        1
+        save_member_indexes()
+
+def eval_source(debugger, code, source, options):
+    """
+    Evaluate the statements in `code` (from the file `source`) with a single command
+
+    Includes and pragmas (e.g. `#pragma cling load`) are hoisted to the global scope unless the whole
+    code is evaluated globally anyway, all other preprocessor directives stay in place. Diagnostics are
+    reported with the lines in `source`.
+    """
+    if options.get("global", False):
+        return eval_expr(debugger, code, options, source=source)
+
+    lines = code.split("\n")
+    hoisted = []
+    conditional_depth = 0
+    for (i, line) in enumerate(lines):
+        directive = re.match(r"\s*#\s*(\w+)", line)
+        if directive is None:
+            continue
+        if directive.group(1) in ["if", "ifdef", "ifndef"]:
+            conditional_depth += 1
+        elif directive.group(1) == "endif":
+            conditional_depth -= 1
+        elif directive.group(1) in ["include", "pragma"]:
+            # hoisting them out of a conditional block would ignore the condition
+            if conditional_depth > 0:
+                print("Error: {}:{}: includes and pragmas inside conditional blocks are only supported with "
+                      "--global".format(source, i+1))
+                return CommandResult(1, "", "", 0, 0.0, 0.0)
+            hoisted.append(i)
+
+    if len(hoisted) > 0:
+        result = eval_expr(debugger, "".join(line_directive(i+1, source) + lines[i] + "\n" for i in hoisted),
+                           {"global": True})
+        if result.status != 0:
+            return result
+        for i in hoisted:
+            lines[i] = ""
+    return eval_expr(debugger, "\n".join(lines), options, source=source)
+
+def source_file(debugger, path, options):
+    if not os.path.isfile(path):
+        print(f"Error: no file at `{path}`.")
+        return
+    with open(path, "r") as source:
+        eval_source(debugger, source.read(), path, options)
+
+def print_code(expr):
+    return ("{"
+            "  auto _defrustr_result = " + expr + ";\n"
+            "  Defrustrator::ValuePrinter<decltype(_defrustr_result)>::print(_defrustr_result);"
+            " }")
 
 def print_expr(debugger, expr, options):
     # todo: check if we should print a result
@@ -395,11 +1512,154 @@ def print_expr(debugger, expr, options):
     #  see cling::ValuePrinterSynthesizer::tryAttachVP for the actual check which expressions should be printed
     #  see cling::IncrementalParser::ParseInternal which parses the code and transforms the code
     #   using the ValuePrinterSynthesizer
-    expr = ("{"
-            "  auto _defrustr_result = " + expr + ";\n"
-            "  Defrustrator::ValuePrinter<decltype(_defrustr_result)>::print(_defrustr_result);"
-            " }")
-    eval_expr(debugger, expr, options)
+    expr = print_code(expr)
+    # repeated prints call the function compiled at the first one, if the expression can't be compiled
+    #  into a function the diagnostics are reported by the regular evaluation
+    frame = debugger.GetSelectedTarget().GetProcess().GetSelectedThread().GetSelectedFrame()
+    if not frame.IsValid():
+        raise NoFrameException()
+    result = eval_compiled(debugger, frame, expr, options)
+    if result is None:
+        eval_expr(debugger, expr, options)
+    else:
+        print_result(result)
+
+def watch_code(indices):
+    """
+    Code printing the watched expressions `indices`, each preceded by a marker line
+
+    Exceptions are caught per expression such that one failing expression does not hide the others.
+    """
+    return "\n".join(('Defrustrator::output() << "defrustrator-watch {i}\\n";\n'
+                      'try {print}\n'
+                      'catch (const std::exception& e) {{ Defrustrator::output() << "exception: " << e.what() << "\\n"; }}\n'
+                      'catch (...) {{ Defrustrator::output() << "unknown exception\\n"; }}').format(
+                          i=i, print=print_code(watch_expressions[i]))
+                     for i in indices)
+
+def show_watches(debugger, options):
+    """
+    Evaluate all watched expressions in one call and print them as a table
+
+    All expressions are compiled into one function. If that fails the expressions that do not compile
+    on their own are left out, compiling (and the failures) are cached such that consecutive stops only
+    need a single call.
+    """
+    if len(watch_expressions) == 0:
+        return
+    frame = debugger.GetSelectedTarget().GetProcess().GetSelectedThread().GetSelectedFrame()
+    if not frame.IsValid():
+        raise NoFrameException()
+
+    indices = list(range(len(watch_expressions)))
+    values = {}
+    compiled = compile_code(debugger, frame, watch_code(indices), options)
+    if compiled is None:
+        failed = [i for i in indices if compile_code(debugger, frame, watch_code([i]), options) is None]
+        for i in failed:
+            values[i] = "error: does not compile (see `cling print {}`)".format(watch_expressions[i])
+        indices = [i for i in indices if i not in failed]
+        if len(indices) > 0:
+            compiled = compile_code(debugger, frame, watch_code(indices), options)
+
+    if compiled is not None:
+        result = call_compiled(debugger, frame, compiled, options)
+        if result.status != 0:
+            print_result(result)
+        current = None
+        for line in result.output.splitlines():
+            if line.startswith("defrustrator-watch "):
+                current = int(line.split()[1])
+                values[current] = ""
+            elif current is not None:
+                values[current] += ("\n" if values[current] else "") + line
+
+    # print table, values spanning multiple lines are continued in the value column
+    rows = [(str(i), expr, values.get(i, "").split("\n")) for (i, expr) in enumerate(watch_expressions)]
+    widths = [max(len(row[column]) for row in rows + [("#", "expression", None)]) for column in range(2)]
+    print("{}  {}  value".format("#".rjust(widths[0]), "expression".ljust(widths[1])))
+    for (i, expr, lines) in rows:
+        print("{}  {}  {}".format(i.rjust(widths[0]), expr.ljust(widths[1]), lines[0]))
+        for line in lines[1:]:
+            print("{}  {}  {}".format("".rjust(widths[0]), "".ljust(widths[1]), line))
+
+def watch(debugger, action, args, options):
+    """
+    Add (`args` is the expression), remove (`args` is the index or the expression) or list watched expressions
+    """
+    if action == "add":
+        if args == "":
+            print("Error: watch add takes an expression.")
+            return
+        watch_expressions.append(args)
+        # evaluate the watch list at every stop
+        target = debugger.GetSelectedTarget()
+        if target.GetExecutable().fullpath not in watch_stop_hooks:
+            debugger.HandleCommand('target stop-hook add -o "cling watch show"')
+            watch_stop_hooks.add(target.GetExecutable().fullpath)
+    elif action == "remove":
+        if args.isdigit() and int(args) < len(watch_expressions):
+            del watch_expressions[int(args)]
+        elif args in watch_expressions:
+            watch_expressions.remove(args)
+        else:
+            print("Error: no watched expression `{}`.".format(args))
+    elif action == "list":
+        for (i, expr) in enumerate(watch_expressions):
+            print("{}: {}".format(i, expr))
+    elif action == "show":
+        show_watches(debugger, options)
+    else:
+        print("Error: unknown watch action `{}`.\n".format(action))
+        print(help())
+
+def npy_header(dtype, fortran_order, shape):
+    """
+    Header of a .npy file (format version 1.0) holding an array of `shape`
+    """
+    shape_str = "({},)".format(shape[0]) if len(shape) == 1 else "({})".format(", ".join(str(n) for n in shape))
+    header = "{{'descr': '{}', 'fortran_order': {}, 'shape': {}, }}".format(dtype, fortran_order, shape_str)
+    # the header is padded such that the data is aligned to 64 bytes
+    header += " "*(63 - (10 + len(header)) % 64) + "\n"
+    return b"\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) + header.encode("latin1")
+
+def dump_expr(debugger, expr, filename, options):
+    """
+    Write the elements of the container `expr` evaluates to into `filename`
+
+    The data is copied from the process in chunks without formatting. Files ending with `.npy` (or if
+    the option `npy` is set) get a numpy header, otherwise the raw data is written (unless `raw` is set).
+    """
+    result = eval_expr(debugger, "Defrustrator::dump(" + expr + ");", options, print_output=False)
+    if result.status != 0:
+        return
+    descriptions = [line for line in result.output.splitlines() if line.startswith("defrustrator-data ")]
+    if len(descriptions) == 0:
+        sys.stdout.write(result.output)
+        return
+
+    fields = descriptions[-1].split()
+    address = int(fields[1], 16) if fields[1].startswith("0x") else int(fields[1])
+    dtype = fields[2]
+    fortran_order = fields[3] == "1"
+    shape = [int(n) for n in fields[4:]]
+    size = int(dtype[2:])
+    for n in shape:
+        size *= n
+
+    process = debugger.GetSelectedTarget().GetProcess()
+    npy = not options.get("raw", False) and (options.get("npy", False) or filename.endswith(".npy"))
+    with timed("memory transfer"), open(filename, "wb") as file:
+        if npy:
+            file.write(npy_header(dtype, fortran_order, shape))
+        for offset in range(0, size, dump_chunk_size):
+            error = lldb.SBError()
+            data = process.ReadMemory(address + offset, min(dump_chunk_size, size - offset), error)
+            if error.Fail():
+                print("Error: reading memory at {:#x} failed: {}".format(address + offset, error))
+                return
+            file.write(data)
+    print("Wrote {} bytes ({}, shape {}) to `{}`".format(size, dtype, "x".join(str(n) for n in shape), filename))
 
 def include_file(debugger, filename):
     eval_expr(debugger, f"#include {filename}", {"global": True})
@@ -423,52 +1683,267 @@ def load_config(debugger, conf_path=None):
     else:
         print(f"Warning: config `{conf_path}` already loaded.")
 
-def _load_config(debugger, conf_path):
-    print(f"Loading config {conf_path}")
-    assert os.path.isfile(conf_path)
+def read_config(conf_path):
     with open(conf_path, "r") as read_file:
         conf = json.load(read_file)
-        print("Adding include directories {}".format(' '.join(conf["include_directories"])))
-        include_directories(debugger, conf["include_directories"])
+    for key in ["include_directories", "compile_definitions", "headers", "libraries"]:
+        conf.setdefault(key, [])
+    # headers without quotes or angle brackets are included with quotes
+    conf["headers"] = [header if header[0] in "\"<" else "\""+header+"\"" for header in conf["headers"]]
+    return conf
+
+def compile_definition_code(comp_def):
+    pos = comp_def.find("=")
+    if pos == -1:
+        return "#define {}".format(comp_def)
+    return "#define {} {}".format(comp_def[0:pos], comp_def[pos+1:])
+
+def _load_config(debugger, conf_path, precompiled=False):
+    """
+    Load the config at `conf_path`. If `precompiled` is true the compile definitions and headers are
+    assumed to be part of the precompiled header the interpreter was created with.
+    """
+    print(f"Loading config {conf_path}")
+    assert os.path.isfile(conf_path)
+    interpreter_configs.append(conf_path)
+    conf = read_config(conf_path)
+    print("Adding include directories {}".format(' '.join(conf["include_directories"])))
+    include_directories(debugger, conf["include_directories"])
+    if not precompiled:
         print("Loading compile_definitions {}".format(' '.join(conf["compile_definitions"])))
         for comp_def in conf["compile_definitions"]:
-            pos = comp_def.find("=")
-            if pos == -1:
-                code = "#define {}".format(comp_def)
-            else:
-                code = "#define {} {}".format(comp_def[0:pos], comp_def[pos+1:])
-            #print(code)
-            eval_expr(debugger, code, {"global": True})
+            eval_expr(debugger, compile_definition_code(comp_def), {"global": True})
         print("Loading headers {}".format(' '.join(conf["headers"])))
         for header in conf["headers"]:
-            if header[0] != "\"" and header[0] != "<":
-                header = "\""+header+"\""
             include_file(debugger, header)
-        print("Loading shared libraries {}".format(' '.join(conf["libraries"])))
-        for library in conf["libraries"]:
-            load_library(debugger, library)
+    print("Loading shared libraries {}".format(' '.join(conf["libraries"])))
+    for library in conf["libraries"]:
+        load_library(debugger, library)
+
+def file_signature(path):
+    try:
+        stat = os.stat(path)
+        return [stat.st_size, stat.st_mtime]
+    except OSError:
+        return None
+
+def parse_dependency_file(dep_path):
+    """
+    Get the list of files in the make style dependency file at `dep_path`
+    """
+    with open(dep_path, "r") as dep_file:
+        content = dep_file.read().replace("\\\n", " ")
+    content = content[content.find(":")+1:]
+    # spaces in file names are escaped with a backslash
+    return [dep.replace("\0", " ") for dep in content.replace("\\ ", "\0").split()]
+
+def get_precompiled_header(conf_paths):
+    """
+    Get the path of a precompiled header containing the compile definitions and headers of all
+    configs in `conf_paths`, building it if it does not exist or any of its inputs changed
+
+    The header is stored in the cache directory under a hash of the include directories, compile
+    definitions, headers and the cling version. Returns None if no precompiled header can be used.
+    """
+    if not use_precompiled_headers or not os.path.isfile(pch_compiler):
+        return None
+
+    confs = [read_config(conf_path) for conf_path in conf_paths]
+    include_dirs = [base_path + "/bin/cling/include", base_path + "/include"] + \
+                   [dir for conf in confs for dir in conf["include_directories"]]
+    # same language options and predefined macros as the interpreter, the interpreter validates them
+    #  when loading the header
+    flags = ["-std=c++17", "-D__CLING__"] + ["-I" + dir for dir in include_dirs]
+    # order of the code in the header is the same as without precompiled headers, i.e. the compile
+    #  definitions and then the headers of one config after another (see _load_config)
+    header_code = "".join("#include {}\n".format(header) for header in ["<type_traits>", "<iostream>",
+                                                                        "\"value_printer.hpp\""]) + \
+        "".join("".join(compile_definition_code(comp_def) + "\n" for comp_def in conf["compile_definitions"]) +
+                "".join("#include {}\n".format(header) for header in conf["headers"])
+                for conf in confs)
+    cling_version = [file_signature(pch_compiler), file_signature(base_path + "/bin/cling/lib/libcling.so"),
+                     file_signature(base_path + "/build/liblldbclingbridge.so")]
+    key = hashlib.sha256(json.dumps([flags, header_code, cling_version]).encode("utf-8")).hexdigest()
+
+    pch_dir = os.path.join(cache_path, "pch")
+    pch_path = os.path.join(pch_dir, key + ".pch")
+    manifest_path = os.path.join(pch_dir, key + ".json")
+
+    # check that none of the included files changed since the header was built
+    if os.path.isfile(pch_path) and os.path.isfile(manifest_path):
+        with open(manifest_path, "r") as manifest_file:
+            manifest = json.load(manifest_file)
+        if all(file_signature(dep) == signature for (dep, signature) in manifest.items()):
+            return pch_path
+
+    # a header the interpreter could not load is only built again if any of the included files changed
+    failed_path = failed_manifest_path(pch_path)
+    if os.path.isfile(failed_path):
+        with open(failed_path, "r") as failed_file:
+            manifest = json.load(failed_file)
+        if all(file_signature(dep) == signature for (dep, signature) in manifest.items()):
+            return None
+        os.remove(failed_path)
+
+    print("Building precompiled header (only needed when the configs or included files change)")
+    os.makedirs(pch_dir, exist_ok=True)
+    header_path = os.path.join(pch_dir, key + ".h")
+    dep_path = os.path.join(pch_dir, key + ".d")
+    with open(header_path, "w") as header_file:
+        header_file.write(header_code)
+    tmp_path = pch_path + ".tmp"
+    process = subprocess.run([pch_compiler, "-x", "c++-header"] + flags +
+                             [header_path, "-o", tmp_path, "-MD", "-MF", dep_path],
+                             stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    if process.returncode != 0:
+        print("Warning: building precompiled header failed, falling back to parsing the headers")
+        print(process.stdout)
+        return None
+    manifest = {dep: file_signature(dep) for dep in parse_dependency_file(dep_path)}
+    with open(manifest_path, "w") as manifest_file:
+        json.dump(manifest, manifest_file)
+    os.replace(tmp_path, pch_path)
+    return pch_path
+
+def failed_manifest_path(pch_path):
+    return pch_path[:-len(".pch")] + ".failed.json"
+
+def discard_precompiled_header(pch_path):
+    """
+    Remove the precompiled header at `pch_path` the interpreter could not load and remember the failure
+    """
+    manifest_path = pch_path[:-len(".pch")] + ".json"
+    if os.path.isfile(manifest_path):
+        os.replace(manifest_path, failed_manifest_path(pch_path))
+    if os.path.isfile(pch_path):
+        os.remove(pch_path)
+
+def get_config_index():
+    global config_index
+    if config_index is None:
+        config_index = {}
+        if os.path.isfile(config_index_path):
+            try:
+                with open(config_index_path, "r") as index_file:
+                    config_index = json.load(index_file)
+            except ValueError:
+                print("Warning: config index `{}` is corrupt, rebuilding it".format(config_index_path))
+    return config_index
+
+def save_config_index():
+    os.makedirs(os.path.dirname(config_index_path), exist_ok=True)
+    tmp_path = config_index_path + ".tmp"
+    with open(tmp_path, "w") as index_file:
+        json.dump(get_config_index(), index_file)
+    os.replace(tmp_path, config_index_path)
+
+def find_module_configs(modules):
+    """
+    Get the paths of the configs (`<module>.defrustrator.json`) of all `modules`
+
+    Lookups are answered from the config index, which is keyed by the uuid (build-id) of the module
+    and validated with the modification time of the module's directory (creating or removing a
+    config changes it). Returns a list of (uuid, config path or None).
+    """
+    index = get_config_index()
+    directory_mtimes = {}
+    changed = False
+    result = []
+    for module in modules:
+        module_path = str(module.GetFileSpec())
+        uuid = module.GetUUIDString() or module_path
+        directory = os.path.dirname(module_path)
+        if directory not in directory_mtimes:
+            try:
+                directory_mtimes[directory] = os.stat(directory).st_mtime
+            except OSError:
+                directory_mtimes[directory] = None
+        entry = index.get(uuid)
+        if entry is None or entry["module"] != module_path or entry["directory_mtime"] != directory_mtimes[directory]:
+            conf_path = module_path + ".defrustrator.json"
+            entry = index[uuid] = {
+                "module": module_path,
+                "directory_mtime": directory_mtimes[directory],
+                "config": conf_path if os.path.isfile(conf_path) else None
+            }
+            changed = True
+        result.append((uuid, entry["config"]))
+    if changed:
+        save_config_index()
+    return result
+
+def load_pending_module_configs(debugger):
+    """
+    Apply the configs of all modules loaded since the last command
+    """
+    with pending_modules_lock:
+        modules = list(pending_modules)
+        del pending_modules[:]
+    applied = applied_module_configs.setdefault(debugger.GetSelectedTarget().GetProcess().GetUniqueID(), set())
+    for (uuid, conf_path) in find_module_configs(modules):
+        if uuid not in applied:
+            applied.add(uuid)
+            if conf_path is not None:
+                _load_config(debugger, conf_path)
 
 def load_all_configs(debugger, conf_path=None):
-    # load system configs
+    # find system configs of all modules loaded so far, later modules are handled incrementally
     target = debugger.GetSelectedTarget()
-    for m in target.module_iter():
-        conf_path = str(m.GetFileSpec())+".defrustrator.json"
-        if os.path.isfile(conf_path):
-            _load_config(conf_path)
-    
-    # load user configs
-    for conf_path in loaded_configs:
-        _load_config(debugger, conf_path)
+    with pending_modules_lock:
+        del pending_modules[:]
+    module_configs = find_module_configs(target.module_iter())
+    applied_module_configs.clear()
+    applied_module_configs[target.GetProcess().GetUniqueID()] = set(uuid for (uuid, _) in module_configs)
+    conf_paths = [conf_path for (_, conf_path) in module_configs if conf_path is not None]
+    conf_paths += [conf_path for conf_path in loaded_configs if conf_path not in conf_paths]
+    del interpreter_configs[:]
+
+    # create the interpreter from the precompiled configs
+    precompiled = False
+    pch_path = get_precompiled_header(conf_paths)
+    if pch_path is not None:
+        result = bridge_call(debugger, "defrustrator_init_pch", c_string_literal(pch_path), interruptable=False)
+        if not result.GetError().Success():
+            raise BridgeException("Creating the interpreter failed ({})".format(result.GetError()))
+        status = result.GetValueAsSigned()
+        precompiled = status == 0
+        if status == 2:
+            print("Warning: precompiled header `{}` could not be loaded, it is not used until the configs or "
+                  "included files change".format(pch_path))
+            discard_precompiled_header(pch_path)
+
+    # load system configs and user configs
+    for conf_path in conf_paths:
+        _load_config(debugger, conf_path, precompiled)
 
 def parse_command_options(commands):
+    """
+    Parse leading options of the form `--flag` or `--name=value`
+    """
     options = {}
     pos = 0
     while pos < len(commands) and commands[pos][0:2] == "--":
         keyword_arg = commands[pos][2:]
-        options[keyword_arg] = True
+        if "=" in keyword_arg:
+            (name, value) = keyword_arg.split("=", 1)
+            options[name] = value
+        else:
+            options[keyword_arg] = True
         pos+=1
     return pos, options
 
+def parse_timeout(value):
+    """
+    Parse the value of the `--timeout` option (in seconds), returns None if it is not a positive number
+    """
+    if not isinstance(value, str):
+        return None
+    try:
+        timeout = float(value)
+    except ValueError:
+        return None
+    return timeout if timeout > 0 and math.isfinite(timeout) else None
+
 def cling(debugger, command, result, dict):
     if not debugger.GetSelectedTarget().GetProcess():
         print("Error: no process. Cling commands can only be issued to a running process.")
@@ -488,34 +1963,92 @@ def cling(debugger, command, result, dict):
         print(help())
         return
 
-    if commands[0] == "start":
-        start()
-    elif commands[0] == "include":
-        include_file(debugger, commands[1])
-    elif commands[0] == "include_directories":
-        include_directories(debugger, commands[1:])
-    elif commands[0] == "load_config":
-        if len(commands) != 2:
-            print("Error: load_config takes exactly one argument.\n")
-            print(help())
+    if "timeout" in options:
+        timeout = parse_timeout(options["timeout"])
+        if timeout is None:
+            print("Error: --timeout expects a positive number of seconds (e.g. --timeout=2.5)")
             return None
-        load_config(debugger, commands[1])
-    elif commands[0] == "type_exists":
-        type_exists(debugger, ' '.join(commands[1:]))
-    elif commands[0] == "repl":
-        repl(debugger, options)
-    elif commands[0] == "expression" or commands[0] == "expr" or commands[0] == "e":
-        eval_expr(debugger, ' '.join(commands[pos+1:]), options)
-    elif commands[0] == "print" or commands[0] == "p":
-        print_expr(debugger, ' '.join(commands[pos+1:]), options)
-    elif commands[0] == "load_library":
-        if len(commands) != 2:
-            print("Error: load_library takes exactly one argument.\n")
+        options["timeout"] = timeout
+
+    # these commands do not use the interpreter and as such neither wait for the warm-up nor hold
+    #  the interpreter lock (the status can be queried while the warm-up is running)
+    if commands[0] == "stats":
+        print_stats(options)
+        return None
+    elif commands[0] == "status":
+        print("Interpreter: {}".format(interpreter_status(debugger)))
+        print("Warm-up: {}".format("on" if warmup_enabled else "off"))
+        return None
+    elif commands[0] == "warmup":
+        if len(commands) != 2 or commands[1] not in ["on", "off"]:
+            print("Error: warmup takes exactly one argument (on or off).\n")
             print(help())
             return None
-        load_library(debugger, commands[1])
-    else:
-        print(help())
+        warmup(debugger, commands[1])
+        return None
 
-    return None
+    wait_for_warmup(debugger)
 
+    begin_stats(command)
+    interpreter_lock.acquire()
+    try:
+        prepare_interpreter(debugger)
+        if commands[0] == "start":
+            start()
+        elif commands[0] == "include":
+            include_file(debugger, commands[1])
+        elif commands[0] == "include_directories":
+            include_directories(debugger, commands[1:])
+        elif commands[0] == "load_config":
+            if len(commands) != 2:
+                print("Error: load_config takes exactly one argument.\n")
+                print(help())
+                return None
+            load_config(debugger, commands[1])
+        elif commands[0] == "type_exists":
+            type_exists(debugger, ' '.join(commands[1:]))
+        elif commands[0] == "repl":
+            repl(debugger, options)
+        elif commands[0] == "expression" or commands[0] == "expr" or commands[0] == "e":
+            eval_expr(debugger, ' '.join(commands[pos+1:]), options)
+        elif commands[0] == "print" or commands[0] == "p":
+            print_expr(debugger, ' '.join(commands[pos+1:]), options)
+        elif commands[0] == "dump":
+            if len(commands) < pos+3:
+                print("Error: dump takes an expression and a file name.\n")
+                print(help())
+                return None
+            dump_expr(debugger, ' '.join(commands[pos+1:-1]), commands[-1], options)
+        elif commands[0] == "break-condition":
+            if len(commands) < 2 or not commands[1].isdigit():
+                print("Error: break-condition takes a breakpoint id and an expression.\n")
+                print(help())
+                return None
+            set_break_condition(debugger, int(commands[1]), ' '.join(commands[2:]))
+        elif commands[0] == "source":
+            if len(commands) != pos+2:
+                print("Error: source takes exactly one argument.\n")
+                print(help())
+                return None
+            source_file(debugger, commands[pos+1], options)
+        elif commands[0] == "watch":
+            if len(commands) < pos+2:
+                print("Error: watch takes an action (add, remove, list or show).\n")
+                print(help())
+                return None
+            watch(debugger, commands[pos+1], ' '.join(commands[pos+2:]), options)
+        elif commands[0] == "load_library":
+            if len(commands) != 2:
+                print("Error: load_library takes exactly one argument.\n")
+                print(help())
+                return None
+            load_library(debugger, commands[1])
+        else:
+            print(help())
+    except (NoFrameException, BridgeException) as e:
+        print("Error: {}".format(e))
+    finally:
+        interpreter_lock.release()
+        end_stats()
+
+    return None
@@ -7,12 +7,24 @@
 #include "cling/UserInterface/UserInterface.h"
 #include "clang/AST/Type.h"
 #include "clang/AST/DeclCXX.h"
+#include "clang/AST/ASTContext.h"
+#include "clang/Basic/Diagnostic.h"
+#include "clang/Frontend/CompilerInstance.h"
+#include "clang/Frontend/TextDiagnosticPrinter.h"
+#include "llvm/Support/raw_ostream.h"
 #include <csignal>
 #include <cstdlib>
+#include <cstdint>
+#include <cstring>
+#include <algorithm>
 #include <unistd.h>
 #include <string>
 #include <sstream>
 #include <memory>
+#include <streambuf>
+#include <chrono>
+#include <map>
+#include <exception>
 
 namespace Defrustrator {
 
@@ -23,6 +35,174 @@ static const char* LLVMRESDIR = DEFRUSTRATOR_BASE_PATH "/bin/cling/";
 
 cling::Interpreter::CompilationResult last_compilation_result;
 
+// precompiled header the interpreter is created with (empty if none)
+static std::string pch_path;
+
+// buffer the plugin writes commands into
+static std::vector<char> command_buffer;
+
+/*
+ * Stream buffer keeping only the last `capacity` characters written to it
+ */
+class RingBuffer : public std::streambuf {
+  public:
+    explicit RingBuffer(std::size_t capacity) : data(capacity) {}
+
+    void clear() {
+        written = 0;
+    }
+
+    std::size_t size() const {
+        return std::min(written, data.size());
+    }
+
+    // number of characters that have been overwritten
+    std::size_t dropped() const {
+        return written - size();
+    }
+
+    // copy the content (oldest character first) to `dest`
+    void copy(char* dest) const {
+        std::size_t begin = written % data.size();
+        if (written > data.size()) {
+            std::memcpy(dest, data.data() + begin, data.size() - begin);
+            std::memcpy(dest + data.size() - begin, data.data(), begin);
+        } else {
+            std::memcpy(dest, data.data(), written);
+        }
+    }
+
+  protected:
+    int_type overflow(int_type c) override {
+        if (c != traits_type::eof())
+            data[written++ % data.size()] = traits_type::to_char_type(c);
+        return c;
+    }
+
+    std::streamsize xsputn(const char* s, std::streamsize n) override {
+        for (std::streamsize i=0; i<n; ++i)
+            data[written++ % data.size()] = s[i];
+        return n;
+    }
+
+  private:
+    std::vector<char> data;
+    std::size_t written = 0;
+};
+
+// output of the value printer
+static RingBuffer output_buffer(1 << 20);
+static std::ostream output_stream(&output_buffer);
+
+// diagnostics of the last command
+static std::string diagnostics;
+static llvm::raw_string_ostream diagnostics_stream(diagnostics);
+static std::unique_ptr<clang::TextDiagnosticPrinter> diagnostics_printer;
+static const std::size_t diagnostics_capacity = 1 << 16;
+
+// result of the last command read by the plugin in one go
+//  the header is followed by the diagnostics and the output
+struct ResultHeader {
+    std::int32_t status; // 0: success, 1: failure, 2: more input expected, 3: exception thrown
+    std::uint32_t diagnostics_size;
+    std::uint32_t output_size;
+    std::uint32_t output_dropped;
+    std::uint64_t compile_ns; // time until the command started executing
+    std::uint64_t execute_ns;
+};
+static char result_buffer[sizeof(ResultHeader) + diagnostics_capacity + (1 << 20)];
+
+std::ostream& output() {
+    return output_stream;
+}
+
+// start of the last command and of its execution (marked by the command itself)
+static std::chrono::steady_clock::time_point command_start;
+static std::chrono::steady_clock::time_point execution_start;
+static bool execution_marked = false;
+
+void mark_execution() {
+    execution_start = std::chrono::steady_clock::now();
+    execution_marked = true;
+}
+
+static std::uint64_t nanoseconds(std::chrono::steady_clock::duration duration) {
+    return std::chrono::duration_cast<std::chrono::nanoseconds>(duration).count();
+}
+
+static void begin_command() {
+    command_start = std::chrono::steady_clock::now();
+    execution_marked = false;
+    output_stream.flush();
+    output_buffer.clear();
+    diagnostics_stream.flush();
+    diagnostics.clear();
+}
+
+// write the result of the last command into the result buffer and return its size
+static std::size_t end_command(int status) {
+    auto command_end = std::chrono::steady_clock::now();
+    if (!execution_marked)
+        execution_start = command_end;
+    output_stream.flush();
+    diagnostics_stream.flush();
+
+    ResultHeader header;
+    header.status = status;
+    header.diagnostics_size = std::min(diagnostics.size(), diagnostics_capacity);
+    header.output_size = output_buffer.size();
+    header.output_dropped = output_buffer.dropped();
+    header.compile_ns = nanoseconds(execution_start - command_start);
+    header.execute_ns = nanoseconds(command_end - execution_start);
+
+    char* pos = result_buffer;
+    std::memcpy(pos, &header, sizeof(header));
+    pos += sizeof(header);
+    std::memcpy(pos, diagnostics.data(), header.diagnostics_size);
+    pos += header.diagnostics_size;
+    output_buffer.copy(pos);
+    pos += header.output_size;
+    return pos - result_buffer;
+}
+
+// write the (qualified) names declared in `context` to the output, one per line
+//  names reserved for the implementation (starting with an underscore) and namespaces holding
+//  implementation details are skipped
+static void write_declared_names(const clang::DeclContext* context, const std::string& prefix, int depth) {
+    for (const clang::Decl* decl : context->decls()) {
+        if (const clang::LinkageSpecDecl* linkage = llvm::dyn_cast<clang::LinkageSpecDecl>(decl)) {
+            write_declared_names(linkage, prefix, depth);
+            continue;
+        }
+        // members of inline namespaces (e.g. std::__cxx11) are accessible without their name
+        const clang::NamespaceDecl* ns = llvm::dyn_cast<clang::NamespaceDecl>(decl);
+        if (ns && ns->isInline()) {
+            write_declared_names(ns, prefix, depth);
+            continue;
+        }
+        const clang::NamedDecl* named = llvm::dyn_cast<clang::NamedDecl>(decl);
+        if (!named || !named->getIdentifier() || named->getName().startswith("_"))
+            continue;
+        std::string name = prefix + named->getName().str();
+        output() << name << "\n";
+
+        if (ns && depth < 3 && named->getName() != "internal" && named->getName() != "detail")
+            write_declared_names(ns, name + "::", depth+1);
+    }
+}
+
+static int compilation_status() {
+    return last_compilation_result == cling::Interpreter::CompilationResult::kSuccess ? 0
+           : last_compilation_result == cling::Interpreter::CompilationResult::kFailure ? 1 : 2;
+}
+
+// functions compiled from expressions by the plugin, called with the addresses of the bound variables
+static std::map<int, void(*)(void**)> compiled_functions;
+
+void register_compiled(int id, void (*function)(void**)) {
+    compiled_functions[id] = function;
+}
+
 }
 
 // c interface
@@ -34,13 +214,31 @@ extern "C" {
         #ifdef DEBUG
         std::cout << "[DEBUG] reset_interpreter" << std::endl;
         #endif
-        int argc = 4;
-        char const** argv = new const char*[3];
-        argv[0] = "dummy"; // todo: use executablename path from lldb
-        argv[1] = "-I" DEFRUSTRATOR_BASE_PATH "/bin/cling/include";
-        argv[2] = "-I" DEFRUSTRATOR_BASE_PATH "/include";
-        argv[3] = "-std=c++17";
-        interpreter.reset(new cling::Interpreter(argc, argv, LLVMRESDIR));
+        // functions compiled by the previous interpreter are gone with it
+        compiled_functions.clear();
+        std::vector<const char*> argv;
+        argv.push_back("dummy"); // todo: use executablename path from lldb
+        argv.push_back("-I" DEFRUSTRATOR_BASE_PATH "/bin/cling/include");
+        argv.push_back("-I" DEFRUSTRATOR_BASE_PATH "/include");
+        argv.push_back("-std=c++17");
+        if (!pch_path.empty()) {
+            // the header is validated against the options of the interpreter, if they do not match
+            //  loading fails and defrustrator_init_pch falls back to an interpreter without it
+            argv.push_back("-include-pch");
+            argv.push_back(pch_path.c_str());
+        }
+        interpreter.reset(new cling::Interpreter(argv.size(), argv.data(), LLVMRESDIR));
+
+        // collect diagnostics such that the plugin can report them
+        clang::CompilerInstance* ci = interpreter->getCI();
+        clang::DiagnosticsEngine& diags = ci->getDiagnostics();
+        diagnostics_printer.reset(new clang::TextDiagnosticPrinter(diagnostics_stream, &ci->getDiagnosticOpts()));
+        diagnostics_printer->BeginSourceFile(ci->getLangOpts(), &ci->getPreprocessor());
+        diags.setClient(diagnostics_printer.get(), false);
+        // statements like `a;` are valid input
+        diags.setSeverityForGroup(clang::diag::Flavor::WarningOrError, "unused-value",
+                                  clang::diag::Severity::Ignored);
+
         interpreter->declare("#include <type_traits>");
         interpreter->declare("#include <iostream>");
     }
@@ -52,7 +250,24 @@ extern "C" {
         }
     }
 
-    void defrustrator_add_include_path(char* path) {
+    // create the interpreter using the precompiled header at `path`
+    //  returns 0 on success, 1 if the interpreter already exists and 2 if the precompiled header
+    //  could not be loaded (the interpreter is then created without it)
+    int defrustrator_init_pch(const char* path) {
+        if (interpreter)
+            return 1;
+        pch_path = path;
+        defrustrator_init();
+        if (interpreter->getCI()->getDiagnostics().hasErrorOccurred()) {
+            pch_path.clear();
+            defrustrator_reset_interpreter();
+            interpreter->declare("#include \"value_printer.hpp\"");
+            return 2;
+        }
+        return 0;
+    }
+
+    void defrustrator_add_include_path(const char* path) {
         defrustrator_init();
         interpreter->AddIncludePath(path);
     }
@@ -73,22 +288,73 @@ extern "C" {
         return -1;
     }
 
-    bool defrustrator_type_exists(char* type) {
+    bool defrustrator_type_exists(const char* type) {
         defrustrator_init();
         const cling::LookupHelper& lookup = interpreter->getLookupHelper();
         clang::QualType cl_A = lookup.findType(type, cling::LookupHelper::WithDiagnostics);
         return !cl_A.isNull();
     }
 
-    void* defrustrator_send_command(char* command) {
+    const unsigned char* defrustrator_types_exist(const char** types, int count) {
+        // bitmap holding the result, bit i is set if types[i] exists
+        static std::vector<unsigned char> result;
+        result.assign((count+7)/8, 0);
+        for (int i=0; i<count; ++i) {
+            if (defrustrator_type_exists(types[i]))
+                result[i/8] |= 1 << (i%8);
+        }
+        return result.data();
+    }
+
+    char* defrustrator_reserve_command_buffer(std::size_t size) {
+        if (command_buffer.size() < size)
+            command_buffer.resize(size);
+        return command_buffer.data();
+    }
+
+    const char* defrustrator_result_buffer() {
+        return result_buffer;
+    }
+
+    std::size_t defrustrator_send_command(const char* command, std::size_t length) {
         #ifdef DEBUG
         std::cout << "[DEBUG] send_command" << std::endl;
         #endif
         defrustrator_init();
+        begin_command();
 
         std::unique_ptr<cling::Value> result(new cling::Value);
-        last_compilation_result = interpreter->process(command, result.get(), nullptr, false);
+        last_compilation_result = interpreter->process(std::string(command, length), result.get(), nullptr, false);
 
-        return result->hasValue() ? result->template getAs<void*>() : nullptr;
+        return end_command(compilation_status());
+    }
+
+    std::size_t defrustrator_declared_names() {
+        defrustrator_init();
+        begin_command();
+        write_declared_names(interpreter->getCI()->getASTContext().getTranslationUnitDecl(), "", 0);
+        return end_command(0);
+    }
+
+    std::size_t defrustrator_call_compiled(int id, void** args) {
+        begin_command();
+        auto function = compiled_functions.find(id);
+        if (function == compiled_functions.end()) {
+            diagnostics_stream << "error: no compiled expression with id " << id << "\n";
+            return end_command(1);
+        }
+
+        mark_execution();
+        int status = 0;
+        try {
+            function->second(args);
+        } catch (const std::exception& e) {
+            diagnostics_stream << "error: exception thrown: " << e.what() << "\n";
+            status = 3;
+        } catch (...) {
+            diagnostics_stream << "error: unknown exception thrown\n";
+            status = 3;
+        }
+        return end_command(status);
     }
 }